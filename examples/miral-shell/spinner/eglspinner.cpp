@@ -18,6 +18,7 @@
 
 #include "eglapp.h"
 #include "miregl.h"
+#include "embedded_image.h"
 #include <assert.h>
 #include <glib.h>
 #include <string.h>
@@ -62,6 +63,8 @@ static GLuint load_shader(const char *src, GLenum type)
 template <typename Image>
 void uploadTexture (GLuint id, Image& image)
 {
+    auto const pixels = embedded_image::decode(image);
+
     glBindTexture(GL_TEXTURE_2D, id);
 
     glTexImage2D(GL_TEXTURE_2D,
@@ -72,7 +75,7 @@ void uploadTexture (GLuint id, Image& image)
                  0,
                  GL_RGBA,
                  GL_UNSIGNED_BYTE,
-                 image.pixel_data);
+                 pixels.data());
     glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR);
     glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR);
     glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE);
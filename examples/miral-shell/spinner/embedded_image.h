@@ -0,0 +1,103 @@
+/*
+ * Copyright © Canonical Ltd.
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * under the terms of the GNU General Public License version 2 or 3 as
+ * published by the Free Software Foundation.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses/>.
+ */
+
+#ifndef MIRAL_SHELL_SPINNER_EMBEDDED_IMAGE_H
+#define MIRAL_SHELL_SPINNER_EMBEDDED_IMAGE_H
+
+#include <cstddef>
+#include <cstring>
+#include <stdexcept>
+#include <utility>
+#include <vector>
+
+// Gets at the pixels of an image written by png2header.py, either as they are (pixel_data)
+// or run length encoded (png2header.py --run-length gives run_length_data)
+namespace embedded_image
+{
+// Each packet starts with a byte n. If n & 0x80 the packet is one pixel, repeated
+// (n & 0x7f) + 1 times, otherwise it is n + 1 pixels as they are
+inline auto decode_run_length(
+    unsigned char const* data, std::size_t size, std::size_t pixels, std::size_t bytes_per_pixel)
+-> std::vector<unsigned char>
+{
+    std::vector<unsigned char> result(pixels * bytes_per_pixel);
+    auto out = result.data();
+    auto const out_end = out + result.size();
+    auto const end = data + size;
+
+    while (data != end)
+    {
+        std::size_t const count = (*data & 0x7f) + 1;
+        bool const repeat = *data++ & 0x80;
+        std::size_t const in_size = repeat ? bytes_per_pixel : count * bytes_per_pixel;
+
+        if (std::size_t(end - data) < in_size || std::size_t(out_end - out) < count * bytes_per_pixel)
+            throw std::runtime_error{"Run length encoded image data is corrupt"};
+
+        if (repeat)
+        {
+            for (std::size_t i = 0; i != count; ++i, out += bytes_per_pixel)
+                std::memcpy(out, data, bytes_per_pixel);
+        }
+        else
+        {
+            std::memcpy(out, data, in_size);
+            out += in_size;
+        }
+        data += in_size;
+    }
+
+    if (out != out_end)
+        throw std::runtime_error{"Run length encoded image data is truncated"};
+
+    return result;
+}
+
+// The pixels of an image: decoded into a buffer, or pointing into the image itself
+class Pixels
+{
+public:
+    explicit Pixels(unsigned char const* data) : pixels{data} {}
+    explicit Pixels(std::vector<unsigned char> decoded) : decoded{std::move(decoded)}, pixels{this->decoded.data()} {}
+
+    Pixels(Pixels const&) = delete;
+    auto operator=(Pixels const&) -> Pixels& = delete;
+
+    auto data() const -> unsigned char const* { return pixels; }
+
+private:
+    std::vector<unsigned char> const decoded;
+    unsigned char const* const pixels;
+};
+
+template <typename Image>
+auto decode(Image const& image) -> decltype((void)image.pixel_data, Pixels{nullptr})
+{
+    return Pixels{image.pixel_data};
+}
+
+template <typename Image>
+auto decode(Image const& image) -> decltype((void)image.run_length_data, Pixels{nullptr})
+{
+    return Pixels{decode_run_length(
+        image.run_length_data,
+        image.run_length_size,
+        std::size_t(image.width) * image.height,
+        image.bytes_per_pixel)};
+}
+}
+
+#endif //MIRAL_SHELL_SPINNER_EMBEDDED_IMAGE_H
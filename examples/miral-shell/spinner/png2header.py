@@ -15,10 +15,23 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import concurrent.futures
+import contextlib
+import io
+import itertools
+import os
+import random
+import re
 import sys
+import time
 from PIL import Image
 
-def premultiply(image):
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+def premultiply_per_pixel(image):
     pixels = image.load()
     for i in range(image.size[0]):
         for j in range(image.size[1]):
@@ -26,6 +39,85 @@ def premultiply(image):
             m = orig[3] / 255.0
             pixels[i,j] = (int(orig[0] * m) , int(orig[1] * m), int(orig[2] * m), orig[3])
 
+# PREMULTIPLIED[a << 8 | c] is colour value c premultiplied by alpha a, rounded
+# exactly as premultiply_per_pixel() does
+PREMULTIPLIED = bytes(int(c * (a / 255.0)) for a in range(256) for c in range(256))
+
+def premultiplied_rgba(data):
+    """Premultiplies the colour values in a buffer of RGBA pixels"""
+    if numpy is not None:
+        pixels = numpy.frombuffer(data, numpy.uint8).reshape(-1, 4).copy()
+        table = numpy.frombuffer(PREMULTIPLIED, numpy.uint8).reshape(256, 256)
+        pixels[:, :3] = table[pixels[:, 3:], pixels[:, :3]]
+        return pixels.tobytes()
+    result = bytearray(data)
+    alpha = data[3::4]
+    for channel in range(3):
+        result[channel::4] = bytes(PREMULTIPLIED[a << 8 | c] for c, a in zip(data[channel::4], alpha))
+    return bytes(result)
+
+def premultiply(image):
+    image.frombytes(premultiplied_rgba(image.tobytes()))
+
+def check_premultiply():
+    """Compares premultiply() with premultiply_per_pixel() for every colour and alpha value"""
+    image = Image.new('RGBA', (256, 256))
+    image.putdata([(c, 255 - c, (c * 7) % 256, a) for a in range(256) for c in range(256)])
+    expected = image.copy()
+    premultiply_per_pixel(expected)
+    premultiply(image)
+    if image.tobytes() != expected.tobytes():
+        print("premultiply() does not match premultiply_per_pixel()", file=sys.stderr)
+        return 1
+    print("premultiply() matches premultiply_per_pixel() (using %s)" % ("numpy" if numpy else "a lookup table"))
+    return 0
+
+def check_run_length():
+    """Checks that run length encoding and decoding images with runs of all lengths reproduces them"""
+    rng = random.Random(0)
+    for bytes_per_pixel in [3, 4]:
+        for _ in range(50):
+            data = b''.join(bytes([rng.randrange(3)] * bytes_per_pixel) * rng.choice([1, 1, 2, 127, 128, 129, 300])
+                            for _ in range(rng.randrange(100)))
+            if run_length_decode(run_length_encode(data, bytes_per_pixel), bytes_per_pixel) != data:
+                print("run_length_decode() does not reverse run_length_encode()", file=sys.stderr)
+                return 1
+    print("run_length_decode() reverses run_length_encode()")
+    return 0
+
+def check_write_cstring():
+    """Compares write_cstring() with tocstring() for runs of short and long escapes ending at and around line ends"""
+    rng = random.Random(0)
+    samples = [b'', bytes(range(256)), b'\0' * 40, b'\0' * 41, b'\377' * 20, b'\377' * 21]
+    samples += [bytes(rng.choice([0, 7, 8, 63, 64, 255]) for _ in range(rng.randrange(2000))) for _ in range(100)]
+    for data in samples:
+        for block_size in [1, 3, 64, 65536]:
+            out = io.StringIO()
+            write_cstring(data, out, block_size)
+            if out.getvalue() != tocstring(data):
+                print("write_cstring() does not match tocstring()", file=sys.stderr)
+                return 1
+    print("write_cstring() matches tocstring()")
+    return 0
+
+def benchmark_cstring(width=3840, height=2160):
+    """Times tocstring() and write_cstring() on the pixels of a random RGBA image"""
+    data = random.Random(0).randbytes(width * height * 4)
+    print("%dx%d RGBA image, %d bytes" % (width, height, len(data)))
+    start = time.perf_counter()
+    expected = tocstring(data)
+    reference_time = time.perf_counter() - start
+    print("  tocstring()     %7.2f s" % reference_time)
+    out = io.StringIO()
+    start = time.perf_counter()
+    write_cstring(data, out)
+    elapsed = time.perf_counter() - start
+    print("  write_cstring() %7.2f s (%.1fx faster)" % (elapsed, reference_time / elapsed))
+    if out.getvalue() != expected:
+        print("write_cstring() does not match tocstring()", file=sys.stderr)
+        return 1
+    return 0
+
 def tocstring(data):
     result = ''
     line_chars = 0
@@ -48,6 +140,25 @@ def tocstring(data):
 
     return result
 
+OCTAL_ESCAPES = ['\\%o' % c for c in range(256)]
+
+# tocstring() ends a line with the first escape that takes it to 80 characters or more:
+# the first 80 characters and the rest of any escape they end part way through
+CSTRING_LINE = re.compile(r'.{80}[0-7]*')
+
+def write_cstring(data, out, block_size=65536):
+    """Writes the same text as tocstring(data) to out, escaping and splitting it into lines
+    a block of data at a time"""
+    text = ''
+    for block_start in range(0, len(data), block_size):
+        text += ''.join(map(OCTAL_ESCAPES.__getitem__, data[block_start:block_start + block_size]))
+        lines = CSTRING_LINE.findall(text)
+        if lines:
+            out.write('    "' + '"\n    "'.join(lines) + '"\n')
+            text = text[sum(map(len, lines)):]
+    if text:
+        out.write('    "' + text + '"')
+
 def bytes_per_pixel(image):
     if image.mode == 'RGBA':
         return 4
@@ -56,30 +167,246 @@ def bytes_per_pixel(image):
     else:
         raise "Unsupported image mode %s" % image.mode
 
-def export(image, variable_name):
+def run_length_encode(data, bytes_per_pixel):
+    """Encodes pixels as packets, each starting with a byte n. If n & 0x80 the packet is one
+    pixel, repeated (n & 0x7f) + 1 times, otherwise it is n + 1 pixels as they are.
+    embedded_image.h in examples/miral-shell/spinner has the matching decoder"""
+    pixels = [data[i:i + bytes_per_pixel] for i in range(0, len(data), bytes_per_pixel)]
+    packets = []
+    literal = []
+
+    def end_literal():
+        for i in range(0, len(literal), 128):
+            packets.append(bytes([len(literal[i:i + 128]) - 1]) + b''.join(literal[i:i + 128]))
+        literal.clear()
+
+    for pixel, run in itertools.groupby(pixels):
+        count = sum(1 for _ in run)
+        if count == 1:
+            literal.append(pixel)
+            continue
+        end_literal()
+        while count > 0:
+            packets.append(bytes([0x80 | (min(count, 128) - 1)]) + pixel)
+            count -= 128
+    end_literal()
+    return b''.join(packets)
+
+def run_length_decode(data, bytes_per_pixel):
+    result = bytearray()
+    i = 0
+    while i < len(data):
+        count = (data[i] & 0x7f) + 1
+        if data[i] & 0x80:
+            result += data[i + 1:i + 1 + bytes_per_pixel] * count
+            i += 1 + bytes_per_pixel
+        else:
+            result += data[i + 1:i + 1 + count * bytes_per_pixel]
+            i += 1 + count * bytes_per_pixel
+    return bytes(result)
+
+def encoded_pixels(image, variable_name, run_length):
+    """Returns the image's pixels, run length encoded if run_length is set, and the name of the header's field for them"""
+    data = image.tobytes()
+    if not run_length:
+        return data, "pixel_data"
+    encoded = run_length_encode(data, bytes_per_pixel(image))
+    print("%s: %d bytes run length encoded to %d (%.1f%% smaller)" % (
+        variable_name, len(data), len(encoded), 100.0 * (len(data) - len(encoded)) / len(data)), file=sys.stderr)
+    return encoded, "run_length_data"
+
+def export(image, variable_name, run_length=False):
     image_info = (image.size[0], image.size[1], bytes_per_pixel(image))
+    data, field = encoded_pixels(image, variable_name, run_length)
     print("static const struct {")
     print("    unsigned int width;")
     print("    unsigned int height;")
     print("    unsigned int bytes_per_pixel; /* 3:RGB, 4:RGBA */")
-    print("    unsigned char pixel_data[%d * %d * %d + 1];" % image_info)
+    if run_length:
+        print("    unsigned int run_length_size; /* see embedded_image.h */")
+        print("    unsigned char run_length_data[%d + 1];" % len(data))
+    else:
+        print("    unsigned char pixel_data[%d * %d * %d + 1];" % image_info)
     print("} %s = {" % variable_name)
     print("    %d, %d, %d," % image_info)
-    print(tocstring(image.tobytes()))
+    if run_length:
+        print("    %d," % len(data))
+    write_cstring(data, sys.stdout)
+    print()
     print("};")
 
+# GNU assembler syntax (as accepted by both GCC and Clang) for any architecture
+INCBIN_ASSEMBLY = """\
+    .section .rodata
+    .global %(symbol)s
+    .type %(symbol)s, %%object
+    .balign 16
+%(symbol)s:
+    .incbin "%(blob)s"
+    .size %(symbol)s, . - %(symbol)s
+    .section .note.GNU-stack, "", %%progbits
+"""
+
+def export_incbin(image, variable_name, assembly_filename, run_length=False):
+    """Writes the pixels to a binary file next to assembly_filename, and an assembly file
+    including it in the object file as VARNAME_pixel_data (or VARNAME_run_length_data). The
+    header only declares that symbol, so compiling it costs nothing whatever the size of the image"""
+    image_info = (image.size[0], image.size[1], bytes_per_pixel(image))
+    data, field = encoded_pixels(image, variable_name, run_length)
+    symbol = variable_name + "_" + field
+    blob_filename = os.path.splitext(os.path.abspath(assembly_filename))[0] + ".bin"
+    blob_changed = write_if_changed(blob_filename, data)
+    assembly_changed = write_if_changed(assembly_filename, INCBIN_ASSEMBLY % {"symbol": symbol, "blob": blob_filename})
+    if blob_changed and not assembly_changed:
+        # Builds don't know that the assembly file includes the blob, so touch it to be reassembled
+        os.utime(assembly_filename)
+    print("#ifdef __cplusplus")
+    print("extern \"C\" {")
+    print("#endif")
+    if run_length:
+        print("extern const unsigned char %s[%d];" % (symbol, len(data)))
+    else:
+        print("extern const unsigned char %s[%d * %d * %d];" % ((symbol,) + image_info))
+    print("#ifdef __cplusplus")
+    print("}")
+    print("#endif")
+    print()
+    print("static const struct {")
+    print("    unsigned int width;")
+    print("    unsigned int height;")
+    print("    unsigned int bytes_per_pixel; /* 3:RGB, 4:RGBA */")
+    if run_length:
+        print("    unsigned int run_length_size; /* see embedded_image.h */")
+    print("    unsigned char const* %s;" % field)
+    print("} %s = {" % variable_name)
+    print("    %d, %d, %d," % image_info)
+    if run_length:
+        print("    %d," % len(data))
+    print("    %s" % symbol)
+    print("};")
+
+def write_if_changed(filename, content):
+    """Writes content (a str or bytes) to filename unless the file already holds exactly that,
+    so that an unchanged file keeps its timestamp and nothing built from it is rebuilt.
+    Returns whether the file was written"""
+    data = content.encode() if isinstance(content, str) else content
+    try:
+        with open(filename, "rb") as existing:
+            if existing.read() == data:
+                return False
+    except FileNotFoundError:
+        pass
+    with open(filename, "wb") as out:
+        out.write(data)
+    return True
+
+def load_image(image_filename):
+    image = Image.open(image_filename)
+    if image.mode == 'RGBA':
+        premultiply(image)
+    return image
+
+# PNGFILE=VARNAME[:HEADER_FILE], as given to --batch
+BATCH_IMAGE = re.compile(r'(?P<image>.+?)=(?P<variable>[A-Za-z_]\w*)(?::(?P<header>.+))?$')
+
+def convert(image_filename, variable_name, header_filename, incbin=False, run_length=False):
+    """Writes the header for one image of a --batch run (and with incbin, its .S and .bin files
+    beside the header). Returns whether the header changed"""
+    image = load_image(image_filename)
+    header = io.StringIO()
+    with contextlib.redirect_stdout(header):
+        if incbin:
+            export_incbin(image, variable_name, os.path.splitext(header_filename)[0] + ".S", run_length)
+        else:
+            export(image, variable_name, run_length)
+    return write_if_changed(header_filename, header.getvalue())
+
+def convert_all(images, incbin=False, run_length=False, jobs=None):
+    """Converts each (image_filename, variable_name, header_filename) in images, in parallel
+    on up to jobs processes (by default, one per CPU). Returns the headers that changed"""
+    arguments = [(image_filename, variable_name, header_filename, incbin, run_length)
+                 for image_filename, variable_name, header_filename in images]
+    if len(arguments) < 2 or jobs == 1:
+        changed = [convert(*args) for args in arguments]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(jobs) as pool:
+            changed = list(pool.map(convert, *zip(*arguments)))
+    return [header_filename for (_, _, header_filename), header_changed in zip(images, changed) if header_changed]
+
+def batch(args):
+    incbin = False
+    run_length = False
+    jobs = None
+    while args[:1] in [['--incbin'], ['--run-length'], ['--jobs']]:
+        if args[0] == '--incbin':
+            incbin = True
+        elif args[0] == '--run-length':
+            run_length = True
+        elif len(args) > 1 and args[1].isdigit() and int(args[1]) > 0:
+            jobs = int(args[1])
+            args = args[1:]
+        else:
+            break
+        args = args[1:]
+    images = []
+    for arg in args:
+        match = BATCH_IMAGE.match(arg)
+        if match is None:
+            images = []
+            break
+        images.append((match.group("image"), match.group("variable"), match.group("header") or match.group("variable") + ".h"))
+    if not images:
+        show_usage()
+        return 1
+    convert_all(images, incbin, run_length, jobs)
+    return 0
+
 def show_usage():
-    print("Usage: ./png2header.py PNGFILE VARNAME > HEADER_FILE", file=sys.stderr)
+    print("Usage: ./png2header.py [--incbin ASSEMBLY_FILE] [--run-length] PNGFILE VARNAME > HEADER_FILE", file=sys.stderr)
+    print("       ./png2header.py --batch [--incbin] [--run-length] [--jobs N] PNGFILE=VARNAME[:HEADER_FILE]...", file=sys.stderr)
+    print("       ./png2header.py --check", file=sys.stderr)
+    print("       ./png2header.py --benchmark [WIDTH HEIGHT]", file=sys.stderr)
     print("Convert a PNG image to an embeddable C/C++ header file", file=sys.stderr)
+    print("--incbin writes the pixels to a .bin file beside ASSEMBLY_FILE, which includes them", file=sys.stderr)
+    print("in an object file, instead of to the header as a string literal", file=sys.stderr)
+    print("--run-length run length encodes the pixels, to be decoded with embedded_image.h", file=sys.stderr)
+    print("--batch converts many images in parallel, on up to N processes, writing each to HEADER_FILE", file=sys.stderr)
+    print("(by default VARNAME.h) only if it changed. With --incbin the .S file is beside the header", file=sys.stderr)
+    print("--check compares the fast premultiply() and write_cstring() with their reference versions", file=sys.stderr)
+    print("--benchmark times writing the pixels of a WIDTHxHEIGHT (default 4K) image as a C string", file=sys.stderr)
 
-if len(sys.argv) < 3:
-    show_usage()
-    sys.exit(1)
+if __name__ == '__main__':
+    if sys.argv[1:] == ['--check']:
+        sys.exit(check_premultiply() or check_write_cstring() or check_run_length())
 
-image_filename = sys.argv[1]
-variable_name = sys.argv[2]
+    if sys.argv[1:2] == ['--batch']:
+        sys.exit(batch(sys.argv[2:]))
 
-image = Image.open(image_filename)
-if image.mode == 'RGBA':
-    premultiply(image)
-export(image, variable_name)
+    if sys.argv[1:2] == ['--benchmark']:
+        sys.exit(benchmark_cstring(*[int(arg) for arg in sys.argv[2:4]]))
+
+    args = sys.argv[1:]
+    assembly_filename = None
+    run_length = False
+    while args[:1] in [['--incbin'], ['--run-length']]:
+        if args[0] == '--run-length':
+            run_length = True
+            args = args[1:]
+        elif len(args) > 1:
+            assembly_filename = args[1]
+            args = args[2:]
+        else:
+            break
+
+    if len(args) < 2:
+        show_usage()
+        sys.exit(1)
+
+    image_filename = args[0]
+    variable_name = args[1]
+
+    image = load_image(image_filename)
+    if assembly_filename is None:
+        export(image, variable_name, run_length)
+    else:
+        export_incbin(image, variable_name, assembly_filename, run_length)
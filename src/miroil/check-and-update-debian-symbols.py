@@ -8,15 +8,21 @@ To use: Go to your build folder and run "make check-miroil-symbols"""
 
 import sys
 from sys import stderr
+import fcntl
+import hashlib
+import json
 import os
 from os import path
 import subprocess
 import re
+import tempfile
 
-HELPTEXT = __doc__
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), '..', '..', 'tools'))
+import debian_symbols
+import demangle
+import elf_symbols
 
-def get_output_symbols_path():
-    return '/tmp/temp_miroil_debian_symbols.symbols'
+HELPTEXT = __doc__
 
 class Context:
     def __init__(self, args):
@@ -40,7 +46,6 @@ class Context:
         self.library_so_path = self.library_dir_path + '/lib' + self.library_name + '.so.' + str(self.abi_version)
         self.deb_package_name = 'lib' + self.library_name + str(self.abi_version)
         self.deb_symbols_path = 'debian/' + self.deb_package_name + '.symbols.amd64'
-        self.output_symbols_path = get_output_symbols_path()
 
     def validate(self):
         assert path.isdir(self.library_dir_path), 'library dir path (' + self.library_dir_path + ') is not a valid directory'
@@ -79,66 +84,96 @@ class Run:
             '  OUT: ' + '\n       '.join(line for line in self.stdout.split('\n')) + '\n' +
             '  ERR: ' + '\n       '.join(line for line in self.stderr.split('\n')))
 
-class SymbolsFile:
+def version_marker(context):
+    '''Returns the entry that comes before the symbols added in this version of the library'''
+    version_node = context.library_name.upper() + '_' + str(context.abi_version) + '.' + str(context.abi_minor_version)
+    return debian_symbols.SymbolsEntry(
+        [], version_node, version_node, '.'.join(str(i) for i in context.library_version))
+
+class SymbolsFileLock:
+    '''Serializes checks of the same debian symbols file, even from different build directories. The lock
+    is held on the directory containing it, as the file itself is replaced rather than written in place'''
     def __init__(self, context):
-        assert isinstance(context, Context)
-        self.context = context
-        f = open(context.deb_symbols_path, 'r')
-        lines = f.readlines()
-        f.close()
-        self.three_component_version = (
-            str(context.library_version[0]) + '.' +
-            str(context.library_version[1]) + '.' +
-            str(context.library_version[2]))
-        self.version_marker_line = (
-            ' ' + context.library_name.upper() + '_' +
-            str(context.abi_version) + '.' + str(context.abi_minor_version) +
-            '@' + context.library_name.upper() + '_' +
-            str(context.abi_version) + '.' + str(context.abi_minor_version) +
-            ' ' + self.three_component_version + '\n')
-        for i in reversed(range(len(lines))):
-            if lines[i] == self.version_marker_line:
-                self.prev_version_lines = lines[:i]
-                self.current_version_lines = lines[i+1:]
-                return
-        self.prev_version_lines = lines
-        self.current_version_lines = []
-
-    def write(self):
-        f = open(context.deb_symbols_path, 'w')
-        for line in self.prev_version_lines:
-            f.write(line)
-        f.write(self.version_marker_line)
-        for line in self.current_version_lines:
-            f.write(line)
-        f.close()
+        self.fd = os.open(path.dirname(path.abspath(context.deb_symbols_path)), os.O_RDONLY)
+
+    def __enter__(self):
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exception):
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+        os.close(self.fd)
+
+new_symbol_line = re.compile(r'\+ (.+::.+) ([\.\d]+)\n?')
 
 def new_lines_from_unfiltered(unfiltered):
-    '''From the unfiltered (mangled) output of dpkg-gensymbols, returns a usable patch'''
-    result = Run(['c++filt'], stdin=unfiltered)
-    result.assert_success()
-    searched = re.findall('^\+ (.+::.+) ([\.\d]+)$', result.stdout, flags=re.MULTILINE)
-    if searched:
-        filtered = [' (c++)"' + symbol + '" ' + version + '\n' for symbol, version in searched]
-        return list(set(filtered))
-    else:
-        return None
+    '''From the unfiltered (mangled) output of dpkg-gensymbols, returns a usable patch. The diff is
+    fed to c++filt from a temporary file, so its output can be matched line by line as it is read
+    without the pipes deadlocking'''
+    filtered = set()
+    with tempfile.TemporaryFile('w+', encoding='utf-8') as unfiltered_file:
+        unfiltered_file.write(unfiltered)
+        unfiltered_file.seek(0)
+        with subprocess.Popen(['c++filt'], stdin=unfiltered_file, stdout=subprocess.PIPE, encoding='utf-8') as p:
+            for line in p.stdout:
+                match = new_symbol_line.fullmatch(line)
+                if match:
+                    filtered.add(' (c++)"' + match.group(1) + '" ' + match.group(2) + '\n')
+    assert p.returncode == 0, 'Command `c++filt` failed with return code ' + str(p.returncode)
+    return list(filtered) if filtered else None
+
+def expected_symbols(context, bits):
+    '''Returns the symbols that the debian symbols file lists for a library with the given word size, as
+    a set of (is_cpp, "symbol@VERSION"). Returns None if the file uses anything that only
+    dpkg-gensymbols understands: tags other than (c++) and (arch-bits=N), mangled C++ names or #include'''
+    expected = set()
+    for line in debian_symbols.DebianSymbolsFile.read(context.deb_symbols_path).lines():
+        if isinstance(line, str):
+            if line.startswith('#include') or line.startswith(' '):
+                return None
+            continue # the header, '*' fields, '|' alternative dependencies and comments
+        if any(tag != 'c++' and not tag.startswith('arch-bits=') for tag in line.tags) or line.name.startswith('_Z'):
+            return None
+        if line.applies_to(bits):
+            expected.add((line.is_cpp(), line.symbol()))
+    return expected
+
+def exported_symbols(context):
+    '''Reads the symbols exported by the library straight from its dynamic symbol table.
+    Returns them in the form used by expected_symbols(), and the library's word size'''
+    with elf_symbols.ElfFile(context.library_so_path) as elf:
+        symbols = [symbol for symbol in elf.dynamic_symbols() if symbol.defined and symbol.binding != 'LOCAL']
+        bits = elf.bits
+    names = demangle.Demangler().demangle_all([symbol.name for symbol in symbols])
+    exported = set()
+    for symbol, name in zip(symbols, names):
+        version = symbol.version if symbol.version != None else 'Base'
+        exported.add((symbol.name.startswith('_Z'), name + '@' + version))
+    return exported, bits
+
+def symbols_match(context):
+    '''A quick check that the library exports exactly the symbols in the debian symbols file, so
+    dpkg-gensymbols only needs to be run to work out what has changed'''
+    exported, bits = exported_symbols(context)
+    return exported == expected_symbols(context, bits)
 
 def check_symbols(context):
     '''Checks the symbols.
     Returns None if all is good, or the lines that need to get added to the debian symbols file otherwise'''
     assert isinstance(context, Context)
-    if (path.isfile(context.output_symbols_path)):
-        os.remove(context.output_symbols_path)
-    args = [
-        'dpkg-gensymbols',
-        '-e' + context.library_so_path,
-        '-p' + context.deb_package_name,
-        '-v' + '.'.join(str(i) for i in context.library_version),
-        '-O' + context.output_symbols_path,
-        '-c4',
-    ]
-    result = Run(args)
+    if symbols_match(context):
+        return None
+    # dpkg-gensymbols insists on writing out a symbols file, which isn't needed
+    with tempfile.TemporaryDirectory(prefix='check-' + context.deb_package_name + '-symbols-') as temp_dir:
+        args = [
+            'dpkg-gensymbols',
+            '-e' + context.library_so_path,
+            '-p' + context.deb_package_name,
+            '-v' + '.'.join(str(i) for i in context.library_version),
+            '-O' + path.join(temp_dir, context.deb_package_name + '.symbols'),
+            '-c4',
+        ]
+        result = Run(args)
     if result.success():
         return None
     else:
@@ -148,19 +183,61 @@ def check_symbols(context):
         else:
             result.assert_success() # Something's not right. This will fail with a useful error
 
+def get_check_record_path(context):
+    return path.join(context.library_dir_path, context.deb_package_name + '.symbols-check.json')
+
+def file_digest(file_path):
+    f = open(file_path, 'rb')
+    digest = hashlib.sha256(f.read()).hexdigest()
+    f.close()
+    return digest
+
+def check_fingerprint(context):
+    '''Identifies everything the result of check_symbols() depends on: the build of the library
+    (by its build ID, or a hash of its dynamic symbols), the debian symbols file and the scripts'''
+    with elf_symbols.ElfFile(context.library_so_path) as elf:
+        library = elf.fingerprint()
+    return {
+        'library': library,
+        'library_version': context.library_version,
+        'symbols_file': file_digest(context.deb_symbols_path),
+        'scripts': [file_digest(script) for script in [
+            __file__, elf_symbols.__file__, demangle.__file__, debian_symbols.__file__]],
+    }
+
+def previously_checked(context, fingerprint):
+    '''Returns True if the symbols were found to be good by a check with the same fingerprint'''
+    try:
+        f = open(get_check_record_path(context), 'r')
+        record = json.load(f)
+        f.close()
+    except (OSError, ValueError):
+        return False
+    return record == fingerprint
+
+def record_check(context, fingerprint):
+    '''Records that the symbols with this fingerprint are good'''
+    debian_symbols.write_atomically(get_check_record_path(context), [json.dumps(fingerprint)])
+
 def append_to_symbols_file(new_symbols, context):
     '''Append a string to the end of the debian symbols file'''
     assert isinstance(new_symbols, list)
-    symbols_file = SymbolsFile(context)
-    symbols_file.current_version_lines += new_symbols
-    symbols_file.current_version_lines.sort()
-    symbols_file.write()
+    symbols_file = debian_symbols.DebianSymbolsFile.read(context.deb_symbols_path)
+    symbols_file.merge(version_marker(context), [debian_symbols.SymbolsEntry.parse(line) for line in new_symbols])
+    symbols_file.write(context.deb_symbols_path)
 
 if __name__ == '__main__':
     context = Context(sys.argv[1:])
     context.validate()
-    symbols_to_add = check_symbols(context)
-    if symbols_to_add != None:
-        print('Adding symbols to ' + context.deb_symbols_path + ':\n' + ''.join(symbols_to_add))
-        append_to_symbols_file(symbols_to_add, context)
-        print('Debian symbols added')
+    # Held until the symbols file has been updated, so that a concurrent check sees the symbols this one adds
+    with SymbolsFileLock(context):
+        fingerprint = check_fingerprint(context)
+        if previously_checked(context, fingerprint):
+            sys.exit(0)
+        symbols_to_add = check_symbols(context)
+        if symbols_to_add == None:
+            record_check(context, fingerprint)
+        if symbols_to_add != None:
+            print('Adding symbols to ' + context.deb_symbols_path + ':\n' + ''.join(symbols_to_add))
+            append_to_symbols_file(symbols_to_add, context)
+            print('Debian symbols added')
@@ -2,235 +2,103 @@
 """This script processes the XML generated by "make doc" and produces summary information
 on symbols that libmiroil intends to make public.
 
-To use: Go to your build folder and run "make regenerate-miroil-symbols-map" """
-
-from xml.dom import minidom
+To use: Go to your build folder and run "make regenerate-miroil-symbols-map"
+
+Options:
+  --engine iterparse|minidom|headers
+                              the XML parser to use. iterparse (the default) streams
+                              each file, minidom is the original DOM based reference.
+                              headers scans C++ headers (e.g. include/miroil/miroil/*.h)
+                              instead of Doxygen XML, so "make doc" is not needed
+  --jobs N                    parse N files at a time in worker processes, 0 to use
+                              every CPU. The output is the same as for a serial run
+  --cache FILE                keep the symbols found in each file in FILE, and only
+                              parse the files that have changed since the last run
+  --symbols-map FILE          the existing version script that new symbols are added
+                              to (default: the symbols.map next to this script)
+  --new-stanza                keep all the existing stanzas and put any new symbols
+                              in a new MIROIL_x.(y+1) stanza
+  --output FILE               write the updated map to FILE instead of stdout
+  --check-engines             instead of printing the map, check that every engine
+                              finds the same symbols in the given files
+  --check-headers DIR         instead of printing the map, check that scanning the
+                              headers in DIR finds the same symbols as the XML files
+  --stats                     print the time taken by each phase, the slowest files and
+                              how many compounds and members were visited, published or
+                              rejected by each publishing rule to stderr
+  --trace FILE                write the timing of each phase and file to FILE as Chrome
+                              trace event JSON (for chrome://tracing or Perfetto) """
+
+import argparse
+import os
+from os import path
+import sys
 from sys import argv
 
-HELPTEXT = __doc__
-DEBUG = False
-
-def _get_text(node):
-    substrings = []
-    for node in node.childNodes:
-        if node.nodeType == node.TEXT_NODE:
-            substrings.append(node.data)
-        elif node.nodeType == node.ELEMENT_NODE:
-            substrings.append(_get_text(node))
-    return ''.join(substrings)
-
-def _get_text_for_element(parent, tagname):
-    substrings = []
-
-    for node in parent.getElementsByTagName(tagname):
-        substrings.append(_get_text(node))
-
-    return ''.join(substrings)
-
-def _get_file_location(node):
-    for node in node.childNodes:
-        if node.nodeType == node.ELEMENT_NODE and node.tagName == 'location':
-            return node.attributes['file'].value
-    if DEBUG:
-        print('no location in:', node)
-    return None
-
-def _has_element(node, tagname):
-    for node in node.childNodes:
-        if node.nodeType == node.ELEMENT_NODE and node.tagName in tagname:
-            return True
-    return False
-
-def _print_attribs(node, attribs):
-    for attrib in attribs:
-        print(' ', attrib, '=', node.attributes[attrib].value)
-
-def _concat_text_from_tags(parent, tagnames):
-    substrings = []
-
-    for tag in tagnames:
-        substrings.append(_get_text_for_element(parent, tag))
-
-    return ''.join(substrings)
-
-def _print_location(node):
-    print(' ', 'location', '=', _get_file_location(node))
-
-def _get_attribs(node):
-    kind = node.attributes['kind'].value
-    static = node.attributes['static'].value
-    prot = node.attributes['prot'].value
-    return kind, static, prot
-
-COMPONENT_MAP = {}
-SYMBOLS = {'public' : set(), 'private' : set()}
-
-def _report(publish, symbol):
-    symbol = symbol.replace('~', '?')
-
-    if publish:
-        SYMBOLS['public'].add(symbol)
-    else:
-        SYMBOLS['private'].add(symbol)
-
-    if not DEBUG:
-        return
-
-    if publish:
-        print('  PUBLISH: {}'.format(symbol))
-    else:
-        print('NOPUBLISH: {}'.format(symbol))
-
-OLD_STANZAS = '''MIROIL_2.0 {
-global:'''
-
-END_NEW_STANZA = '''
-local: *;
-};'''
-
-def _print_report():
-    print(OLD_STANZAS)
-    new_symbols = False;
-    for symbol in sorted(SYMBOLS['public']):
-        formatted_symbol = '    {};'.format(symbol)
-        if formatted_symbol not in OLD_STANZAS and 'miroil::' in formatted_symbol:
-            if not new_symbols:
-                new_symbols = True;
-                print('  extern "C++" {')
-            print(formatted_symbol)
-
-    if new_symbols: print("  };")
-    print(END_NEW_STANZA)
-
-def _print_debug_info(node, attributes):
-    if not DEBUG:
-        return
-    print()
-    _print_attribs(node, attributes)
-    _print_location(node)
-
-def _parse_member_def(context_name, node, is_class):
-    kind = node.attributes['kind'].value
-
-    if (kind in ['enum', 'typedef']
-        or _has_element(node, ['templateparamlist'])
-        or kind in ['function'] and node.attributes['inline'].value == 'yes'):
-        return
-
-    name = _concat_text_from_tags(node, ['name'])
-
-    if name in ['__attribute__']:
-        if DEBUG:
-            print('  ignoring doxygen mis-parsing:', _concat_text_from_tags(node, ['argsstring']))
-        return
-
-    if name.startswith('operator'):
-        name = 'operator'
-
-    if not context_name is None:
-        symbol = context_name + '::' + name
-    else:
-        symbol = name
-
-    is_function = kind == 'function'
-
-    if is_function:
-        _print_debug_info(node, ['kind', 'prot', 'static', 'virt'])
-    else:
-        _print_debug_info(node, ['kind', 'prot', 'static'])
-
-    if DEBUG:
-        print('  is_class:', is_class)
-
-    publish = _should_publish(is_class, is_function, node)
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), '..', '..', 'tools'))
+import symbols_map
 
-    _report(publish, symbol + '*')
-
-    if is_function and node.attributes['virt'].value == 'virtual':
-        _report(publish, 'non-virtual?thunk?to?' + symbol + '*')
-
-
-def _should_publish(is_class, is_function, node):
-    (kind, static, prot) = _get_attribs(node)
-
-    publish = True
-
-    if publish:
-        publish = kind != 'define'
-
-    if publish and is_class:
-        publish = is_function or static == 'yes'
-
-    if publish and prot == 'private':
-        if is_function:
-            publish = node.attributes['virt'].value == 'virtual'
-        else:
-            publish = False
-
-    if publish and _has_element(node, ['argsstring']):
-        publish = not _get_text_for_element(node, 'argsstring').endswith('=0')
-
-    return publish
-
-
-def _parse_compound_defs(xmldoc):
-    compounddefs = xmldoc.getElementsByTagName('compounddef')
-    for node in compounddefs:
-        kind = node.attributes['kind'].value
-
-        if kind in ['page', 'file', 'example', 'union']:
-            continue
-
-        if kind in ['group']:
-            for member in node.getElementsByTagName('memberdef'):
-                _parse_member_def(None, member, False)
-            continue
-
-        if kind in ['namespace']:
-            symbol = _concat_text_from_tags(node, ['compoundname'])
-            for member in node.getElementsByTagName('memberdef'):
-                _parse_member_def(symbol, member, False)
-            continue
-
-        filename = _get_file_location(node)
-
-        if DEBUG:
-            print('  from file:', filename)
-
-        if ('/examples/' in filename or '/test/' in filename or '[generated]' in filename
-            or '[STL]' in filename or _has_element(node, ['templateparamlist'])):
-            continue
-
-        symbol = _concat_text_from_tags(node, ['compoundname'])
-
-        publish = True
-
-        if publish:
-            if kind in ['class', 'struct']:
-                prot = node.attributes['prot'].value
-                publish = prot != 'private'
-                _print_debug_info(node, ['kind', 'prot'])
-                _report(publish, 'vtable?for?' + symbol)
-                _report(publish, 'typeinfo?for?' + symbol)
-
-        if publish:
-            for member in node.getElementsByTagName('memberdef'):
-                _parse_member_def(symbol, member, kind in ['class', 'struct'])
+HELPTEXT = __doc__
+NAMESPACE = 'miroil'
 
 if __name__ == "__main__":
     if len(argv) == 1 or '-h' in argv or '--help' in argv:
         print(HELPTEXT)
         exit()
 
-    for arg in argv[1:]:
-        try:
-            if DEBUG:
-                print('Processing:', arg)
-            _parse_compound_defs(minidom.parse(arg))
-        except Exception as error:
-            print('Error:', arg, error)
-
-    if DEBUG:
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('--engine', choices=symbols_map.ENGINES.keys(), default='iterparse',
+                        help='XML parser to use (minidom is the slower reference implementation), '
+                             'or headers to scan C++ headers instead of Doxygen XML')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='number of files to parse in parallel (0 for one per CPU)')
+    parser.add_argument('--cache', metavar='FILE',
+                        help='reuse the symbols found in files that have not changed since the last run')
+    parser.add_argument('--symbols-map', metavar='FILE', default=os.path.join(os.path.dirname(__file__), 'symbols.map'),
+                        help='the existing version script (default: symbols.map next to this script)')
+    parser.add_argument('--new-stanza', action='store_true',
+                        help='keep the existing stanzas and put new symbols in the next minor version')
+    parser.add_argument('--output', metavar='FILE',
+                        help='write the map to FILE rather than stdout (FILE can be the --symbols-map)')
+    parser.add_argument('--check-engines', action='store_true',
+                        help='check that all the parsers find the same symbols instead of printing the map')
+    parser.add_argument('--check-headers', metavar='DIR',
+                        help='check that scanning the headers in DIR finds the same symbols as the Doxygen XML')
+    parser.add_argument('--stats', action='store_true',
+                        help='print timings and counts of what each publishing rule did to stderr')
+    parser.add_argument('--trace', metavar='FILE',
+                        help='write the timings as Chrome trace event JSON to FILE')
+    parser.add_argument('files', nargs='*')
+    args = parser.parse_args()
+
+    stats = symbols_map.STATS
+    stats.enabled = args.stats or args.trace is not None
+
+    if args.check_engines:
+        exit(0 if symbols_map.check_engines(args.files, args.jobs) else 1)
+
+    if args.check_headers:
+        exit(0 if symbols_map.check_headers(args.files, args.engine, args.jobs, args.check_headers, NAMESPACE) else 1)
+
+    symbols_map.parse_files(args.files, args.engine, args.jobs, args.cache)
+
+    if symbols_map.DEBUG:
         print('Processing complete')
 
-    _print_report()
+    with stats.phase('format report'):
+        report = symbols_map.format_report(
+            symbols_map.SymbolsMap.from_file(args.symbols_map), NAMESPACE, args.new_stanza)
+
+    if args.output is None:
+        print(report, end='')
+    else:
+        temp_path = args.output + '.tmp'
+        with open(temp_path, 'w') as f:
+            f.write(report)
+        os.replace(temp_path, args.output)
+
+    if args.stats:
+        stats.print_summary(sys.stderr)
+
+    if args.trace is not None:
+        stats.write_trace(args.trace)
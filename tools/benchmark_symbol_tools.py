@@ -0,0 +1,478 @@
+#! /usr/bin/python3
+# coding: utf-8
+
+# Copyright © Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 or 3
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Benchmarks for the scripts that maintain the symbols.map and debian .symbols files.
+
+USAGE: ./benchmark_symbol_tools.py member-view [--members N]
+       ./benchmark_symbol_tools.py generate-corpus DIR [CORPUS OPTIONS]
+       ./benchmark_symbol_tools.py pipelines [CORPUS OPTIONS] [--corpus DIR] [--repeat N]
+                                             [--baseline FILE] [--save-baseline FILE]
+                                             [--threshold FRACTION]
+       ./benchmark_symbol_tools.py debian-symbols [--lines N]
+
+  member-view       compares the element visits and time taken to extract the parts of
+                    each <memberdef> the publishing rules need from a synthetic large
+                    <compounddef>, rescanning the element per lookup vs one indexed pass
+  generate-corpus   writes a synthetic tree of Doxygen XML to DIR
+  pipelines         times regenerate-miral-symbols-map.py (with each XML engine) and
+                    process_doxygen_xml.py (with and without --low-memory) on a synthetic
+                    corpus, or the XML in --corpus DIR, reporting the median members
+                    parsed per second and peak RSS of --repeat (default 3) runs of each.
+                    With --baseline, exits with 1 if any throughput fell, or peak RSS
+                    grew, by more than --threshold (default 0.25) relative to the results
+                    --save-baseline wrote for an earlier run with the same corpus options.
+                    Timings of fewer than 3 runs, or of a corpus with fewer than 5000
+                    members, vary too much to compare, so these options refuse them
+  debian-symbols    times streaming, parsing, indexing, writing and merging symbols into
+                    a synthetic debian .symbols file of --lines lines (default 200000,
+                    more than libmirserver's), checking that writing it back out
+                    reproduces it exactly
+
+Corpus options (the defaults are roughly the size of Mir's own "make doc" output):
+  --scale X                   multiplies the number of files, e.g. --scale 10
+  --files N                   number of XML files (default 1000)
+  --compounds-per-file N      (default 1, as Doxygen writes them)
+  --members N                 average members per compound (default 10)
+  --depth N                   maximum class nesting depth (default 3)
+  --template-density F        fraction of compounds and members that are templates
+                              (default 0.1)
+  --seed N                    for the random choices (default 0)"""
+
+import argparse
+import glob
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from xml.etree import ElementTree
+import debian_symbols
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+SOURCE_DIR = os.path.join(os.path.dirname(TOOLS_DIR), 'src')
+
+# The headers the synthetic compounds claim to come from: the public headers
+# the symbols map generators publish from and some private library code
+CORPUS_LOCATIONS = [
+    ('miral', 'include/miral/miral/'),
+    ('miroil', 'include/miroil/miroil/'),
+    ('mir', 'include/core/mir/'),
+    ('mir', 'src/server/frontend_wayland/'),
+]
+
+def synthetic_member(compound_name, index, description_paragraphs=20):
+    '''A <memberdef> the size of a well documented Mir member function'''
+    description = ''.join(
+        '<para>Paragraph {} of <ref refid="r{}">{}</ref> <computeroutput>code</computeroutput> text.</para>'
+        .format(i, i, compound_name) for i in range(description_paragraphs))
+    return ('<memberdef kind="function" id="m{0}" prot="public" static="no" const="no" explicit="no"'
+            ' inline="no" virt="virtual">'
+            '<type>void</type><definition>virtual void {1}::member_{0}</definition>'
+            '<argsstring>(int a, int b) const</argsstring><name>member_{0}</name>'
+            '<param><type>int</type><declname>a</declname></param>'
+            '<param><type>int</type><declname>b</declname></param>'
+            '<briefdescription><para>Brief</para></briefdescription>'
+            '<detaileddescription>{2}</detaileddescription>'
+            '<inbodydescription/>'
+            '<location file="include/miral/miral/synthetic.h" line="{0}" column="5"/>'
+            '</memberdef>').format(index, compound_name, description)
+
+def synthetic_compound(members):
+    name = 'miral::Synthetic'
+    return ElementTree.fromstring(
+        '<compounddef id="c" kind="class" language="C++" prot="public">'
+        '<compoundname>{}</compoundname><sectiondef kind="public-func">{}</sectiondef>'
+        '<location file="include/miral/miral/synthetic.h" line="1"/></compounddef>'
+        .format(name, ''.join(synthetic_member(name, i) for i in range(members))))
+
+class CountingElement:
+    '''Wraps an ElementTree element, counting every element visited through it'''
+    def __init__(self, element, counter):
+        self._element = element
+        self._counter = counter
+        self.tag = element.tag
+        self.attrib = element.attrib
+        self.text = element.text
+        self.tail = element.tail
+
+    def __iter__(self):
+        for child in self._element:
+            self._counter[0] += 1
+            yield CountingElement(child, self._counter)
+
+    def get(self, key, default=None):
+        return self._element.get(key, default)
+
+    def find(self, tag):
+        for child in self:
+            if child.tag == tag:
+                return child
+        return None
+
+    def iter(self):
+        yield self
+        for child in self:
+            yield from child.iter()
+
+    def iterfind(self, path):
+        assert path.startswith('.//'), 'only the descendant searches used by the scripts are supported'
+        tag = path[3:]
+        for child in self:
+            for element in child.iter():
+                if element.tag == tag:
+                    yield element
+
+    def itertext(self):
+        if self.text:
+            yield self.text
+        for child in self:
+            yield from child.itertext()
+            if child.tail:
+                yield child.tail
+
+def rescanning_member_def(element):
+    '''The extraction as it was done with a separate search per lookup'''
+    def text_for_element(parent, tagname):
+        return ''.join(''.join(node.itertext()) for node in parent.iterfind('.//' + tagname))
+
+    def has_child_element(parent, tagname):
+        for child in parent:
+            if child.tag == tagname:
+                return True
+        return False
+
+    location = element.find('location')
+    return (
+        text_for_element(element, 'name'),
+        text_for_element(element, 'argsstring') if has_child_element(element, 'argsstring') else None,
+        location.attrib['file'] if location is not None else None,
+        has_child_element(element, 'templateparamlist'))
+
+def indexed_member_def(symbols_map):
+    def extract(element):
+        member = symbols_map._MemberDef.from_element(element)
+        return member.name, member.argsstring, member.location, member.is_template
+    return extract
+
+def corpus_memberdef(rng, compound_name, location, index, template_density):
+    '''A <memberdef> of a random kind, with a random mix of the attributes the publishing rules look at'''
+    kind = rng.choices(['function', 'variable', 'enum', 'typedef'], [70, 15, 10, 5])[0]
+    attributes = 'kind="{}" id="m{}" prot="{}" static="{}"'.format(
+        kind, index, rng.choices(['public', 'protected', 'private'], [75, 10, 15])[0],
+        'yes' if rng.random() < 0.1 else 'no')
+    argsstring = ''
+    if kind == 'function':
+        virt = rng.choices(['non-virtual', 'virtual', 'pure-virtual'], [60, 30, 10])[0]
+        attributes += ' const="no" explicit="no" inline="{}" virt="{}"'.format(
+            'yes' if rng.random() < 0.2 else 'no', virt)
+        argsstring = '<argsstring>(int a, std::string const &amp;b) const{}</argsstring>'.format(
+            '=0' if virt == 'pure-virtual' else '')
+    template = ''
+    if rng.random() < template_density:
+        template = '<templateparamlist><param><type>typename T</type></param></templateparamlist>'
+    return ('<memberdef {0}>{1}<type>void</type><definition>void {2}::member_{3}</definition>{4}'
+            '<name>member_{3}</name>'
+            '<briefdescription><para>Brief description of member_{3}.</para></briefdescription>'
+            '<detaileddescription><para>A longer description mentioning <ref refid="m{3}">{2}</ref>'
+            ' and <computeroutput>code</computeroutput>.</para></detaileddescription>'
+            '<inbodydescription/><location file="{5}" line="{3}" column="5"/>'
+            '</memberdef>').format(attributes, template, compound_name, index, argsstring, location)
+
+def corpus_compounddef(rng, name, kind, location, members, template_density, first_member):
+    template = ''
+    if kind != 'namespace' and rng.random() < template_density:
+        template = '<templateparamlist><param><type>typename T</type></param></templateparamlist>'
+    memberdefs = ''.join(
+        corpus_memberdef(rng, name, location, first_member + i, template_density) for i in range(members))
+    return ('<compounddef id="{0}" kind="{1}" language="C++" prot="{2}">'
+            '<compoundname>{0}</compoundname>{3}'
+            '<sectiondef kind="public-func">{4}</sectiondef>'
+            '<briefdescription/><detaileddescription/>'
+            '<location file="{5}" line="1" column="1"/></compounddef>').format(
+                name, kind, 'private' if rng.random() < 0.05 else 'public', template, memberdefs, location)
+
+def generate_corpus(directory, files=1000, compounds_per_file=1, members=10, depth=3,
+                    template_density=0.1, seed=0):
+    '''Writes a synthetic Doxygen XML file per file to directory, returning the
+    number of <memberdef>s written'''
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    member_count = 0
+    for file_index in range(files):
+        compounds = []
+        for compound_index in range(compounds_per_file):
+            library, header_dir = rng.choice(CORPUS_LOCATIONS)
+            location = '{}synthetic_{}.h'.format(header_dir, file_index)
+            kind = rng.choices(['class', 'struct', 'namespace'], [75, 20, 5])[0]
+            name = '{}::Synthetic{}_{}'.format(library, file_index, compound_index)
+            if kind != 'namespace':
+                for level in range(rng.randint(0, depth - 1)):
+                    name += '::Nested{}'.format(level)
+            count = rng.randint(0, 2 * members)
+            compounds.append(corpus_compounddef(
+                rng, name, kind, location, count, template_density, member_count))
+            member_count += count
+        path = os.path.join(directory, 'synthetic_{}.xml'.format(file_index))
+        with open(path, 'w') as f:
+            f.write("<?xml version='1.0' encoding='UTF-8' standalone='no'?>\n"
+                    '<doxygen version="1.9.1" xml:lang="en-US">{}</doxygen>\n'.format(''.join(compounds)))
+    return member_count
+
+def add_corpus_arguments(parser):
+    parser.add_argument('--scale', type=float, default=1)
+    parser.add_argument('--files', type=int, default=1000)
+    parser.add_argument('--compounds-per-file', type=int, default=1)
+    parser.add_argument('--members', type=int, default=10)
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--template-density', type=float, default=0.1)
+    parser.add_argument('--seed', type=int, default=0)
+
+def generate_corpus_from_args(directory, args):
+    return generate_corpus(
+        directory, int(args.files * args.scale), args.compounds_per_file, args.members,
+        args.depth, args.template_density, args.seed)
+
+def generate_corpus_command(args):
+    start = time.perf_counter()
+    members = generate_corpus_from_args(args.directory, args)
+    print('{} members written to {} in {:.1f} s'.format(members, args.directory, time.perf_counter() - start))
+    return 0
+
+def pipeline_commands():
+    regenerate = os.path.join(SOURCE_DIR, 'miral', 'regenerate-miral-symbols-map.py')
+    process = os.path.join(TOOLS_DIR, 'process_doxygen_xml.py')
+    return [
+        ('regenerate iterparse', [regenerate, '--engine', 'iterparse']),
+        ('regenerate minidom', [regenerate, '--engine', 'minidom']),
+        ('process_doxygen_xml', [process]),
+        ('process_doxygen_xml --low-memory', [process, '--low-memory']),
+    ]
+
+def timed_run(command):
+    '''Runs command, returning its wall time and peak RSS (in MiB)'''
+    start = time.perf_counter()
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    _, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, command)
+    return elapsed, usage.ru_maxrss / 1024     # Linux reports ru_maxrss in KiB
+
+def regressions(results, baseline, threshold):
+    '''Lists the ways results are worse than baseline by more than threshold'''
+    found = []
+    for label, result in results.items():
+        if label not in baseline:
+            continue
+        expected = baseline[label]
+        if result['members_per_s'] < expected['members_per_s'] * (1 - threshold):
+            found.append('{}: {:.0f} members/s, down from {:.0f}'.format(
+                label, result['members_per_s'], expected['members_per_s']))
+        if result['peak_rss_mib'] > expected['peak_rss_mib'] * (1 + threshold):
+            found.append('{}: {:.1f} MiB peak RSS, up from {:.1f}'.format(
+                label, result['peak_rss_mib'], expected['peak_rss_mib']))
+    return found
+
+# Below these, run to run variation (about 20% on a small corpus) is close to --threshold
+MIN_BASELINE_REPEAT = 3
+MIN_BASELINE_MEMBERS = 5000
+
+def count_members(filenames):
+    return sum(1 for filename in filenames
+               for event, element in ElementTree.iterparse(filename) if element.tag == 'memberdef')
+
+def pipelines_benchmark(args):
+    with tempfile.TemporaryDirectory(prefix='benchmark_symbol_tools-') as temp_dir:
+        corpus = args.corpus
+        if corpus is None:
+            corpus = os.path.join(temp_dir, 'xml')
+            generate_corpus_from_args(corpus, args)
+        filenames = sorted(glob.glob(os.path.join(corpus, '*.xml')))
+        members = count_members(filenames)
+        print('{} files, {} members'.format(len(filenames), members))
+        if members < MIN_BASELINE_MEMBERS and (args.baseline is not None or args.save_baseline is not None):
+            print('--baseline and --save-baseline need a corpus of at least {} members'.format(MIN_BASELINE_MEMBERS),
+                  file=sys.stderr)
+            return 2
+
+        results = {}
+        for label, command in pipeline_commands():
+            runs = [timed_run([sys.executable] + command + filenames) for _ in range(args.repeat)]
+            elapsed = statistics.median(run[0] for run in runs)
+            results[label] = {
+                'seconds': elapsed,
+                'members_per_s': members / elapsed,
+                'peak_rss_mib': statistics.median(run[1] for run in runs),
+            }
+            print('  {:34} {:8.2f} s {:10.0f} members/s {:8.1f} MiB peak RSS'.format(
+                label, elapsed, results[label]['members_per_s'], results[label]['peak_rss_mib']))
+
+    if args.save_baseline is not None:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            found = regressions(results, json.load(f), args.threshold)
+        for regression in found:
+            print('REGRESSION: ' + regression)
+        if found:
+            return 1
+    return 0
+
+def synthetic_symbols_file(path, lines, seed=0):
+    '''Writes a debian .symbols file of about lines lines, in the style of libmirserver's, with
+    a version marker every 5000 symbols and some arch-bits pairs and comments. Returns the
+    version markers and the symbols that were left out of it, for merging back in'''
+    rng = random.Random(seed)
+    left_out = []
+    markers = []
+    with open(path, 'w') as f:
+        f.write('libmirserver.so.60 libmirserver60 #MINVER#\n')
+        written = 1
+        while written < lines:
+            version = '2.{}'.format(len(markers))
+            marker = ' MIRSERVER_{0}@MIRSERVER_{0} {0}.0\n'.format(version)
+            markers.append(marker)
+            f.write(marker)
+            written += 1
+            symbols = []
+            for i in range(min(5000, lines - written)):
+                name = 'mir::scene::Synthetic{}::member_{}'.format(rng.randrange(1000), i)
+                types = rng.choice([
+                    '()', '() const', '(int, std::shared_ptr<mir::scene::Surface> const&)',
+                    '(std::vector<mir::geometry::Rectangle, std::allocator<mir::geometry::Rectangle> > const&)'])
+                if rng.random() < 0.05:
+                    symbols.append(' (c++|arch-bits=64)"{}(long){}@MIRSERVER_{}" {}.0\n'.format(name, types[1:], version, version))
+                    symbols.append(' (c++|arch-bits=32)"{}(long long){}@MIRSERVER_{}" {}.0\n'.format(name, types[1:], version, version))
+                else:
+                    symbols.append(' (c++)"{}{}@MIRSERVER_{}" {}.0\n'.format(name, types, version, version))
+            symbols.sort()
+            for symbol in symbols:
+                if rng.random() < 0.01:
+                    left_out.append((marker, symbol))
+                    continue
+                if rng.random() < 0.001:
+                    f.write('# a comment about the next symbol\n')
+                    written += 1
+                f.write(symbol)
+                written += 1
+    return left_out
+
+def debian_symbols_benchmark(args):
+    with tempfile.TemporaryDirectory(prefix='benchmark_symbol_tools-') as temp_dir:
+        path = os.path.join(temp_dir, 'libmirserver60.symbols')
+        left_out = synthetic_symbols_file(path, args.lines)
+        with open(path) as f:
+            original = f.read()
+        print('{} lines, {} symbols to merge back in'.format(original.count('\n'), len(left_out)))
+
+        def step(label, run):
+            start = time.perf_counter()
+            result = run()
+            elapsed = time.perf_counter() - start
+            print('  {:34} {:8.1f} ms {:10.0f} lines/s'.format(label, elapsed * 1000, args.lines / elapsed))
+            return result
+
+        step('stream (read_lines)', lambda: sum(1 for _ in debian_symbols.read_lines(path)))
+        symbols_file = step('read into DebianSymbolsFile', lambda: debian_symbols.DebianSymbolsFile.read(path))
+        entries = symbols_file.entries()
+        step('split_name_and_types', lambda: [debian_symbols.split_name_and_types(entry.name) for entry in entries])
+        step('look up every symbol', lambda: [symbols_file.find(entry.name, entry.version) for entry in entries])
+        copy_path = path + '.copy'
+        step('write', lambda: symbols_file.write(copy_path))
+        with open(copy_path) as f:
+            if f.read() != original:
+                print('ERROR: writing the file back out changed it')
+                return 1
+
+        def merge():
+            by_marker = {}
+            for marker, symbol in left_out:
+                by_marker.setdefault(marker, []).append(debian_symbols.SymbolsEntry.parse(symbol))
+            for marker, new_entries in by_marker.items():
+                symbols_file.merge(debian_symbols.SymbolsEntry.parse(marker), new_entries)
+        step('merge the left out symbols', merge)
+        symbols_file.write(copy_path)
+        with open(copy_path) as f:
+            merged = f.read()
+        if sorted(merged.splitlines()) != sorted(original.splitlines() + [symbol.rstrip('\n') for _, symbol in left_out]):
+            print('ERROR: merging did not add exactly the left out symbols')
+            return 1
+    return 0
+
+def member_view_benchmark(args):
+    import symbols_map
+    compound = synthetic_compound(args.members)
+    memberdefs = list(compound.iter('memberdef'))
+    approaches = [
+        ('rescan per lookup', rescanning_member_def),
+        ('indexed view', indexed_member_def(symbols_map)),
+    ]
+
+    print('{} members, {} elements in the compound'.format(len(memberdefs), sum(1 for _ in compound.iter())))
+    results = {}
+    for label, extract in approaches:
+        counter = [0]
+        results[label] = [extract(CountingElement(member, counter)) for member in memberdefs]
+        start = time.perf_counter()
+        for member in memberdefs:
+            extract(member)
+        elapsed = time.perf_counter() - start
+        print('  {:20} {:10} element visits {:8.1f} ms'.format(label, counter[0], elapsed * 1000))
+
+    reference = results[approaches[0][0]]
+    for label, result in results.items():
+        if result != reference:
+            print('ERROR: ' + label + ' extracted different values')
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    if len(sys.argv) == 1 or '-h' in sys.argv or '--help' in sys.argv:
+        print(__doc__)
+        sys.exit()
+
+    parser = argparse.ArgumentParser(add_help=False)
+    subcommands = parser.add_subparsers(dest='benchmark', required=True)
+    member_view = subcommands.add_parser('member-view', add_help=False)
+    member_view.add_argument('--members', type=int, default=2000)
+    member_view.set_defaults(run=member_view_benchmark)
+    corpus = subcommands.add_parser('generate-corpus', add_help=False)
+    corpus.add_argument('directory')
+    add_corpus_arguments(corpus)
+    corpus.set_defaults(run=generate_corpus_command)
+    pipelines = subcommands.add_parser('pipelines', add_help=False)
+    add_corpus_arguments(pipelines)
+    pipelines.add_argument('--corpus')
+    pipelines.add_argument('--repeat', type=int, default=MIN_BASELINE_REPEAT)
+    pipelines.add_argument('--baseline')
+    pipelines.add_argument('--save-baseline')
+    pipelines.add_argument('--threshold', type=float, default=0.25)
+    pipelines.set_defaults(run=pipelines_benchmark)
+    symbols = subcommands.add_parser('debian-symbols', add_help=False)
+    symbols.add_argument('--lines', type=int, default=200000)
+    symbols.set_defaults(run=debian_symbols_benchmark)
+    args = parser.parse_args()
+    if args.benchmark == 'pipelines' and args.repeat < MIN_BASELINE_REPEAT and (
+            args.baseline is not None or args.save_baseline is not None):
+        pipelines.error('--baseline and --save-baseline need --repeat {} or more'.format(MIN_BASELINE_REPEAT))
+    sys.exit(args.run(args))
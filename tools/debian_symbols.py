@@ -0,0 +1,252 @@
+#! /usr/bin/python3
+# coding: utf-8
+
+# Copyright © Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 or 3
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Reads, edits and writes debian .symbols files (see deb-symbols(5)).
+
+USAGE: ./debian_symbols.py SYMBOLS_FILE
+
+Prints the number of symbols listed under each version marker of SYMBOLS_FILE
+(a line such as " MIRAL_4.0@MIRAL_4.0 4.0.0"), and any lines that are not understood.
+
+A DebianSymbolsFile keeps every line of the file, in order, so that writing it back
+out without changes reproduces the file exactly. Symbol lines become SymbolsEntrys,
+with their tags (e.g. "c++" and "arch-bits=32"), and are indexed by their name and
+version. Everything else (the header, comments, blank lines and fields) is kept as
+text."""
+
+import gc
+import os
+from os import path
+import re
+import sys
+import tempfile
+
+_ENTRY = re.compile(r'^ (?:\((?P<tags>[^)]*)\))?(?:"(?P<quoted>[^"]*)"|(?P<symbol>\S+)) (?P<min_version>\S+)(?P<rest>.*)$')
+_TYPES_START = re.compile(r'[(<]')
+_INTEGER_LITERAL_SUFFIX = re.compile(r'\b(\d+)l?l\b')
+_INTEGER_TYPE = re.compile(r'\blong long\b|\blong\b|\bint\b')
+
+# A version node of one of the libraries, e.g. MIRAL_5.0 (but not GLIBC_PRIVATE)
+VERSION_NODE = re.compile(r'(?P<lib>\w+)_(?P<version>[\d\.]+)')
+
+def split_name_and_types(symbol):
+    '''Splits a demangled symbol such as "mir::Foo<int>::bar(long)" before the first "(" or "<"'''
+    match = _TYPES_START.search(symbol)
+    if match is None:
+        return symbol, ''
+    return symbol[:match.start()], symbol[match.start():]
+
+def width_independent_types(types):
+    '''Spells the integer types in types the same whatever their width, so that e.g.
+    "(long, std::ratio<1l, 1000l>)" and "(long long, std::ratio<1ll, 1000ll>)" match'''
+    return _INTEGER_TYPE.sub('int', _INTEGER_LITERAL_SUFFIX.sub(r'\1', types))
+
+class SymbolsEntry:
+    '''One symbol line, such as ' (c++|arch-bits=32)"miral::foo(int)@MIRAL_4.0" 4.0.0'. The
+    version is the version node (e.g. MIRAL_4.0), or None for an unversioned symbol. rest is anything
+    after the minimal version (e.g. the id of a dependency template)'''
+    __slots__ = ('tags', 'name', 'version', 'min_version', 'quoted', 'rest')
+
+    def __init__(self, tags, name, version, min_version, quoted=None, rest=''):
+        self.tags = tuple(tags)
+        self.name = name
+        self.version = version
+        self.min_version = min_version
+        self.quoted = bool(self.tags) if quoted is None else quoted
+        self.rest = rest
+
+    @staticmethod
+    def parse(line):
+        '''Returns the SymbolsEntry for line, or None if it isn't a symbol line'''
+        if not line.startswith(' '):
+            return None
+        match = _ENTRY.match(line.rstrip('\n'))
+        if match is None:
+            return None
+        tags, quoted_symbol, symbol, min_version, rest = match.groups()
+        quoted = quoted_symbol is not None
+        if quoted:
+            symbol = quoted_symbol
+        name, at, version = symbol.rpartition('@')
+        if not at:
+            name, version = symbol, None
+        return SymbolsEntry(tags.split('|') if tags is not None else (), name, version, min_version, quoted, rest)
+
+    def symbol(self):
+        return self.name if self.version is None else self.name + '@' + self.version
+
+    def prefix(self):
+        '''The tags as they are written, e.g. "(c++|arch-bits=32)"'''
+        return '(' + '|'.join(self.tags) + ')' if self.tags else ''
+
+    def is_cpp(self):
+        return 'c++' in self.tags
+
+    def is_version_marker(self):
+        '''True for the line naming a version node, which comes before the symbols added with that version'''
+        return not self.tags and self.name == self.version
+
+    def applies_to(self, bits):
+        '''False if an arch-bits tag excludes architectures with a word size of bits'''
+        return all(tag == 'arch-bits=' + str(bits) for tag in self.tags if tag.startswith('arch-bits='))
+
+    def key(self):
+        return (self.name, self.version)
+
+    def sort_key(self):
+        '''Orders entries as the debian/*.symbols files do: by name@version, with the arch-bits
+        variants of a symbol together (the 64 bit one first) where the name would put them apart'''
+        bits = [int(tag[len('arch-bits='):]) for tag in self.tags if tag.startswith('arch-bits=')]
+        if not bits:
+            return (self.symbol(), 0, str(self))
+        return (width_independent_types(self.symbol()), -bits[0], str(self))
+
+    def __str__(self):
+        symbol = '"' + self.symbol() + '"' if self.quoted else self.symbol()
+        return ' ' + self.prefix() + symbol + ' ' + self.min_version + self.rest
+
+def parse_lines(lines):
+    '''Yields a SymbolsEntry for each symbol line in lines (which may be an open file or a pipe), and
+    each other line as a string, without the line ending'''
+    for text in lines:
+        text = text.rstrip('\n')
+        entry = SymbolsEntry.parse(text)
+        yield entry if entry is not None else text
+
+def read_lines(file_path):
+    '''Yields the lines of a .symbols file, as parse_lines() does, without reading it all in first'''
+    with open(file_path, 'r') as f:
+        yield from parse_lines(f)
+
+class VersionBlock:
+    '''The version marker entry (None for any lines before the first one) and the lines
+    following it up to the next marker. Each line is either a SymbolsEntry or a string'''
+    def __init__(self, marker):
+        self.marker = marker
+        self.lines = []
+
+    def entries(self):
+        return [line for line in self.lines if isinstance(line, SymbolsEntry)]
+
+class DebianSymbolsFile:
+    def __init__(self, lines):
+        '''lines are the lines of a .symbols file, with or without their line endings'''
+        self.blocks = [VersionBlock(None)]
+        self.index = {}     # (name, version) -> the SymbolsEntrys for it (more than one for arch-bits variants)
+        # Nothing parsed refers back to anything else, so the cyclic garbage collector repeatedly
+        # scanning the growing index would be wasted time (around a third of it for a large file)
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            for line in parse_lines(lines):
+                if isinstance(line, SymbolsEntry) and line.is_version_marker():
+                    self.blocks.append(VersionBlock(line))
+                else:
+                    self._add(line, self.blocks[-1].lines)
+        finally:
+            if collecting:
+                gc.enable()
+
+    @staticmethod
+    def read(file_path):
+        with open(file_path, 'r') as f:
+            return DebianSymbolsFile(f)
+
+    def _add(self, line, lines):
+        lines.append(line)
+        if isinstance(line, SymbolsEntry):
+            self.index.setdefault(line.key(), []).append(line)
+
+    def lines(self):
+        '''Yields every line of the file in order, as a SymbolsEntry (including the version markers) or a string'''
+        for block in self.blocks:
+            if block.marker is not None:
+                yield block.marker
+            yield from block.lines
+
+    def entries(self):
+        '''Returns the symbols, leaving out the version markers'''
+        return [entry for block in self.blocks for entry in block.entries()]
+
+    def find(self, name, version):
+        '''Returns the entries for the symbol name@version (the name being demangled for a C++ symbol)'''
+        return self.index.get((name, version), [])
+
+    def contains(self, entry):
+        return any(existing.tags == entry.tags for existing in self.find(entry.name, entry.version))
+
+    def block(self, marker):
+        '''Returns the (last) block with the given version marker, adding one to the end of the file if needed'''
+        for block in reversed(self.blocks):
+            if block.marker is not None and str(block.marker) == str(marker):
+                return block
+        block = VersionBlock(marker)
+        self.blocks.append(block)
+        return block
+
+    def merge(self, marker, entries):
+        '''Adds the entries that are not already listed to the block with the given version marker. The
+        block is assumed to be sorted (see SymbolsEntry.sort_key()), and each entry goes into its sorted
+        position in a single pass'''
+        new = sorted({str(entry): entry for entry in entries if not self.contains(entry)}.values(),
+                     key=SymbolsEntry.sort_key)
+        block = self.block(marker)
+        new_keys = [entry.sort_key() for entry in new]
+        merged = []
+        i = 0
+        for line in block.lines:
+            if isinstance(line, SymbolsEntry):
+                key = line.sort_key()
+                while i < len(new) and new_keys[i] < key:
+                    self._add(new[i], merged)
+                    i += 1
+            merged.append(line)
+        for entry in new[i:]:
+            self._add(entry, merged)
+        block.lines = merged
+        return new
+
+    def write(self, file_path):
+        write_atomically(file_path, [str(line) + '\n' for line in self.lines()])
+
+def write_atomically(file_path, lines):
+    '''Replaces the file at file_path with one containing lines, so that readers (and anything
+    killed part way through) see either the old file or the new one, never a partial one'''
+    fd, temp_path = tempfile.mkstemp(dir=path.dirname(path.abspath(file_path)), prefix='.' + path.basename(file_path) + '.')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            for line in lines:
+                f.write(line)
+        if path.isfile(file_path):
+            os.chmod(temp_path, os.stat(file_path).st_mode & 0o7777)
+        os.replace(temp_path, file_path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2 or sys.argv[1] in ['-h', '--help']:
+        print(__doc__)
+        sys.exit()
+    symbols_file = DebianSymbolsFile.read(sys.argv[1])
+    for block in symbols_file.blocks:
+        entries = block.entries()
+        if block.marker is not None or entries:
+            print('{:24} {:6} symbols'.format(block.marker.version if block.marker else '(no version)', len(entries)))
+        for line in block.lines:
+            if isinstance(line, str) and line.startswith(' '):
+                print('  not understood: ' + line.strip())
@@ -0,0 +1,152 @@
+#! /usr/bin/python3
+# coding: utf-8
+
+# Copyright © Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 or 3
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Demangles C++ symbol names in bulk, without starting a process per name.
+
+USAGE: ./demangle.py [--no-cache] MANGLED_NAME...
+
+Each batch of names is demangled by a single c++filt process, as c++filt's spelling
+is the one dpkg-gensymbols writes to the debian .symbols files (e.g. it expands
+std::ostream where __cxa_demangle doesn't). If there is no c++filt, libstdc++'s
+__cxa_demangle is called in-process through ctypes instead. Results are kept in a
+least recently used cache on disk (see default_cache_path()), so rescanning a
+library only demangles the names that are new."""
+
+import collections
+import ctypes
+import ctypes.util
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+def default_cache_path():
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'mir', 'demangle-cache.json')
+
+def _load_cxa_demangle():
+    '''Returns a function demangling one name with __cxa_demangle, or None if libstdc++ can't be loaded'''
+    try:
+        libstdcxx = ctypes.CDLL(ctypes.util.find_library('stdc++') or 'libstdc++.so.6')
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6')
+    except OSError:
+        return None
+    cxa_demangle = libstdcxx.__cxa_demangle
+    cxa_demangle.restype = ctypes.c_void_p
+    cxa_demangle.argtypes = [ctypes.c_char_p, ctypes.c_void_p, ctypes.c_void_p, ctypes.POINTER(ctypes.c_int)]
+    libc.free.argtypes = [ctypes.c_void_p]
+
+    def demangle(name):
+        status = ctypes.c_int()
+        buffer = cxa_demangle(name.encode('utf-8'), None, None, ctypes.byref(status))
+        if status.value != 0 or not buffer:
+            return name     # as c++filt does for anything that isn't a valid mangled name
+        try:
+            return ctypes.string_at(buffer).decode('utf-8')
+        finally:
+            libc.free(buffer)
+    return demangle
+
+def _cxxfilt(names):
+    '''Demangles names with one c++filt process. The names are fed to it from a temporary file, so
+    its output can be read line by line without the pipes deadlocking'''
+    with tempfile.TemporaryFile('w+', encoding='utf-8') as names_file:
+        names_file.writelines(name + '\n' for name in names)
+        names_file.seek(0)
+        with subprocess.Popen(['c++filt'], stdin=names_file, stdout=subprocess.PIPE, encoding='utf-8') as process:
+            demangled = [line.rstrip('\n') for line in process.stdout]
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, ['c++filt'])
+    assert len(demangled) == len(names), 'c++filt returned ' + str(len(demangled)) + ' names for ' + str(len(names))
+    return demangled
+
+class Demangler:
+    '''Demangles names, remembering up to max_entries of the results in the
+    JSON file at cache_path (if not None) between runs'''
+    def __init__(self, cache_path=None, max_entries=200000):
+        self.cache_path = cache_path
+        self.max_entries = max_entries
+        self.cache = collections.OrderedDict()  # mangled name -> demangled, least recently used first
+        self.modified = False
+        self.cxa_demangle = None if shutil.which('c++filt') else _load_cxa_demangle()
+        self.backend = 'c++filt' if self.cxa_demangle is None else '__cxa_demangle'
+        if cache_path is not None and os.path.isfile(cache_path):
+            try:
+                with open(cache_path, 'r') as f:
+                    cached = json.load(f)
+                if cached.get('backend') == self.backend:
+                    self.cache.update(cached['names'])
+            except (ValueError, KeyError, AttributeError):
+                pass    # a corrupt cache is just rebuilt
+
+    def demangle(self, name):
+        return self.demangle_all([name])[0]
+
+    def demangle_all(self, names):
+        '''Returns the demangled form of each of names, in order'''
+        missing = [name for name in dict.fromkeys(names) if name.startswith('_Z') and name not in self.cache]
+        if missing:
+            if self.cxa_demangle is not None:
+                demangled = [self.cxa_demangle(name) for name in missing]
+            else:
+                demangled = _cxxfilt(missing)
+            self.cache.update(zip(missing, demangled))
+            self.modified = True
+        # Hits only need saving if they change the order names are evicted in, which they
+        # don't when the same names are demangled in the same order as in the last run
+        order = None if self.modified else list(self.cache)
+        result = []
+        for name in names:
+            if name in self.cache:
+                self.cache.move_to_end(name)
+                result.append(self.cache[name])
+            else:
+                result.append(name)
+        if order is not None and list(self.cache) != order:
+            self.modified = True
+        return result
+
+    def save(self):
+        '''Writes the cache back to disk, if any names were added or used in a different order,
+    dropping the least recently used names beyond max_entries'''
+        while len(self.cache) > self.max_entries:
+            self.cache.popitem(last=False)
+        if self.cache_path is None or not self.modified:
+            return
+        temp_path = self.cache_path + '.' + str(os.getpid()) + '.tmp'
+        try:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            with open(temp_path, 'w') as f:
+                json.dump({'backend': self.backend, 'names': self.cache}, f)
+            os.replace(temp_path, self.cache_path)
+        except OSError as error:
+            print('WARNING: could not write ' + self.cache_path + ': ' + str(error), file=sys.stderr)
+        self.modified = False
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if not args or '-h' in args or '--help' in args:
+        print(__doc__)
+        sys.exit()
+    use_cache = '--no-cache' not in args
+    names = [arg for arg in args if arg != '--no-cache']
+    demangler = Demangler(default_cache_path() if use_cache else None)
+    for name in demangler.demangle_all(names):
+        print(name)
+    demangler.save()
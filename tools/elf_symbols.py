@@ -0,0 +1,213 @@
+#! /usr/bin/python3
+# coding: utf-8
+
+# Copyright © Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 or 3
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Reads the dynamic symbol table of an ELF shared object directly, instead of
+running and parsing the output of nm -D, readelf or dpkg-gensymbols.
+
+USAGE: ./elf_symbols.py LIBRARY
+
+Prints the defined dynamic symbols of LIBRARY as "TYPE BINDING NAME@VERSION", with
+@@ marking the default version of a symbol (as nm -D does).
+
+The library is mmap()ed and only the section headers, .dynsym, .gnu.version,
+.gnu.version_d and .gnu.version_r are decoded. Each name is read straight out
+of the mapped .dynstr rather than from a copy of the string table."""
+
+import collections
+import hashlib
+import mmap
+import struct
+import sys
+
+SHT_NOTE = 7
+SHT_DYNSYM = 11
+SHT_GNU_VERDEF = 0x6ffffffd
+SHT_GNU_VERNEED = 0x6ffffffe
+SHT_GNU_VERSYM = 0x6fffffff
+SHN_UNDEF = 0
+VERSYM_HIDDEN = 0x8000
+VER_NDX_GLOBAL = 1
+NT_GNU_BUILD_ID = 3
+
+SYMBOL_TYPES = {0: 'NOTYPE', 1: 'OBJECT', 2: 'FUNC', 3: 'SECTION', 4: 'FILE', 5: 'COMMON', 6: 'TLS', 10: 'GNU_IFUNC'}
+SYMBOL_BINDINGS = {0: 'LOCAL', 1: 'GLOBAL', 2: 'WEAK', 10: 'GNU_UNIQUE'}
+
+# The version is the name of the version node (e.g. MIRAL_5.0), or None for an
+# unversioned symbol. default_version is False for a hidden (name@VERSION
+# rather than name@@VERSION) symbol
+ElfSymbol = collections.namedtuple(
+    'ElfSymbol', ['name', 'type', 'binding', 'version', 'size', 'defined', 'default_version'])
+
+Section = collections.namedtuple('Section', ['type', 'offset', 'size', 'link', 'info', 'entsize'])
+
+class ElfFile:
+    '''A read-only mapping of an ELF file, to be used as a context manager'''
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._read_headers()
+        except Exception:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+    def close(self):
+        self.data.close()
+
+    def _read_headers(self):
+        ident = self.data[:16]
+        if len(ident) < 16 or ident[:4] != b'\x7fELF' or ident[4] not in (1, 2) or ident[5] not in (1, 2):
+            raise ValueError(self.path + ' is not an ELF file')
+        self.bits = 32 if ident[4] == 1 else 64
+        self.byte_order = '<' if ident[5] == 1 else '>'
+        if self.bits == 64:
+            header_format, section_format, self.symbol_format = 'HHIQQQIHHHHHH', 'IIQQQQIIQQ', 'IBBHQQ'
+        else:
+            header_format, section_format, self.symbol_format = 'HHIIIIIHHHHHH', 'IIIIIIIIII', 'IIIBBH'
+        header = self._unpack(header_format, 16)
+        section_offset, section_size, section_count = header[5], header[10], header[11]
+        self.sections = []
+        for i in range(section_count):
+            (_, sh_type, _, _, offset, size, link, info, _, entsize) = self._unpack(
+                section_format, section_offset + i * section_size)
+            self.sections.append(Section(sh_type, offset, size, link, info, entsize))
+
+    def _unpack(self, format, offset):
+        return struct.unpack_from(self.byte_order + format, self.data, offset)
+
+    def _section(self, sh_type):
+        for section in self.sections:
+            if section.type == sh_type:
+                return section
+        return None
+
+    def _string(self, table, offset):
+        start = self.sections[table].offset + offset
+        return self.data[start:self.data.find(b'\0', start)].decode('utf-8')
+
+    def build_id(self):
+        '''Returns the NT_GNU_BUILD_ID note as a hex string, or None if there isn't one'''
+        for section in self.sections:
+            if section.type != SHT_NOTE:
+                continue
+            offset = section.offset
+            end = section.offset + section.size
+            while offset + 12 <= end:
+                (name_size, description_size, note_type) = self._unpack('III', offset)
+                name_offset = offset + 12
+                description_offset = name_offset + (name_size + 3) // 4 * 4
+                if note_type == NT_GNU_BUILD_ID and self.data[name_offset:name_offset + name_size] == b'GNU\0':
+                    return self.data[description_offset:description_offset + description_size].hex()
+                offset = description_offset + (description_size + 3) // 4 * 4
+        return None
+
+    def dynamic_symbols_digest(self):
+        '''Returns a SHA-256 of the sections that dynamic_symbols() decodes'''
+        digest = hashlib.sha256()
+        dynsym = self._section(SHT_DYNSYM)
+        sections = [dynsym, self.sections[dynsym.link]] if dynsym is not None else []
+        sections += [self._section(sh_type) for sh_type in [SHT_GNU_VERSYM, SHT_GNU_VERDEF, SHT_GNU_VERNEED]]
+        for section in sections:
+            if section is not None:
+                digest.update(self.data[section.offset:section.offset + section.size])
+        return digest.hexdigest()
+
+    def fingerprint(self):
+        '''Identifies this build of the file: by its build ID if it has one, otherwise
+        by a hash of its dynamic symbols'''
+        build_id = self.build_id()
+        if build_id is not None:
+            return 'build-id:' + build_id
+        return 'dynsym-sha256:' + self.dynamic_symbols_digest()
+
+    def version_names(self):
+        '''Maps each version index used in .gnu.version to the version's name'''
+        names = {}
+        verdef = self._section(SHT_GNU_VERDEF)
+        if verdef is not None:
+            offset = verdef.offset
+            for _ in range(verdef.info):
+                (_, flags, index, _, _, aux, next) = self._unpack('HHHHIII', offset)
+                (name, _) = self._unpack('II', offset + aux)
+                names[index] = self._string(verdef.link, name)
+                offset += next
+        verneed = self._section(SHT_GNU_VERNEED)
+        if verneed is not None:
+            offset = verneed.offset
+            for _ in range(verneed.info):
+                (_, count, _, aux, next) = self._unpack('HHIII', offset)
+                aux_offset = offset + aux
+                for _ in range(count):
+                    (_, _, index, name, aux_next) = self._unpack('IHHII', aux_offset)
+                    names[index] = self._string(verneed.link, name)
+                    aux_offset += aux_next
+                offset += next
+        return names
+
+    def dynamic_symbols(self):
+        '''Yields an ElfSymbol for each entry in .dynsym after the initial null symbol'''
+        dynsym = self._section(SHT_DYNSYM)
+        if dynsym is None:
+            return
+        versym = self._section(SHT_GNU_VERSYM)
+        versions = self.version_names()
+        for i in range(1, dynsym.size // dynsym.entsize):
+            if self.bits == 64:
+                (name, info, _, shndx, _, size) = self._unpack(self.symbol_format, dynsym.offset + i * dynsym.entsize)
+            else:
+                (name, _, size, info, _, shndx) = self._unpack(self.symbol_format, dynsym.offset + i * dynsym.entsize)
+            version = None
+            default_version = True
+            if versym is not None:
+                (index,) = self._unpack('H', versym.offset + 2 * i)
+                default_version = not index & VERSYM_HIDDEN
+                version = versions.get(index & ~VERSYM_HIDDEN) if index & ~VERSYM_HIDDEN > VER_NDX_GLOBAL else None
+            yield ElfSymbol(
+                self._string(dynsym.link, name),
+                SYMBOL_TYPES.get(info & 0xf, str(info & 0xf)),
+                SYMBOL_BINDINGS.get(info >> 4, str(info >> 4)),
+                version,
+                size,
+                shndx != SHN_UNDEF,
+                default_version)
+
+def read_dynamic_symbols(path):
+    '''Returns a list of the ElfSymbols in the dynamic symbol table of the ELF file at path'''
+    with ElfFile(path) as elf:
+        return list(elf.dynamic_symbols())
+
+def exported_symbols(path):
+    '''Returns the ElfSymbols that the shared object at path defines for other objects to use'''
+    return [symbol for symbol in read_dynamic_symbols(path)
+            if symbol.defined and symbol.binding != 'LOCAL']
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2 or sys.argv[1] in ['-h', '--help']:
+        print(__doc__)
+        sys.exit()
+    for symbol in exported_symbols(sys.argv[1]):
+        name = symbol.name
+        if symbol.version is not None:
+            name += ('@@' if symbol.default_version else '@') + symbol.version
+        print(symbol.type, symbol.binding, name)
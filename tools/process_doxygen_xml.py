@@ -1,6 +1,14 @@
-#! /usr/bin/python
+#! /usr/bin/python3
 from xml.dom import minidom
+from xml.etree import ElementTree
 from sys import argv
+import argparse
+import glob
+import heapq
+import os
+import resource
+import sys
+import tempfile
 
 helptext = \
 """This script processes the XML generated by "make doc" and produces summary information
@@ -9,10 +17,23 @@ on symbols that Mir intends to make public.
 To use:
 
 1. Go to your build folder and run "make doc"
-2. Create summary by running "../tools/process_doxygen_xml.py doc/xml/*.xml > raw-output"
-3. For each symbol map (e.g. mirserver)
-3.1. cat raw-output | grep "^mirserver public" | sed "s/mirserver public: /    /" | sort > mirserver-public-symbols
-3.2. vi -d mirserver-public-symbols ../src/server/symbols.map"""
+2. Create candidate symbol maps for every library by running
+   "../tools/process_doxygen_xml.py --output-dir symbols doc/xml/*.xml"
+3. For each symbol map (e.g. server)
+3.1. vi -d symbols/server.symbols.map ../src/server/symbols.map
+
+The libraries are found from the src/*/symbols.map files next to this script, use
+--source-dir to look elsewhere.
+
+Without --output-dir the raw summary of every symbol found is printed instead, one
+"COMPONENT public|private: SYMBOL;" line per symbol.
+
+For XML covering the whole tree use --low-memory. This streams the XML instead of
+building a DOM for each file and, once --spill-after symbols (default 100000) are
+held, writes them to sorted runs in a temporary directory that are merged back
+into the sorted output. --memory-budget MiB reports the peak memory used on stderr
+and fails if it was over budget: on CI, all of Mir's XML should process with
+"--low-memory --memory-budget 64"."""
 
 debug = False
 
@@ -35,7 +56,7 @@ def get_file_location(node):
     for node in node.childNodes:
         if node.nodeType == node.ELEMENT_NODE and node.tagName == 'location':
             return node.attributes['file'].value
-    if debug: print 'no location in:', node
+    if debug: print('no location in:', node)
     return None
 
 def has_element(node, tagname):
@@ -45,7 +66,7 @@ def has_element(node, tagname):
     return False
 
 def print_attribs(node, attribs):
-    for attrib in attribs : print ' ', attrib, '=', node.attributes[attrib].value
+    for attrib in attribs : print(' ', attrib, '=', node.attributes[attrib])
 
 def concat_text_from_tags(parent, tagnames):
     rc = []
@@ -53,14 +74,74 @@ def concat_text_from_tags(parent, tagnames):
     return ''.join(rc)
 
 def print_location(node):
-    print ' ', 'location', '=', get_file_location(node)
+    print(' ', 'location', '=', node.location)
 
 def get_attribs(node):
-    kind = node.attributes['kind'].value
-    static = node.attributes['static'].value
-    prot =  node.attributes['prot'].value
+    kind = node.attributes['kind']
+    static = node.attributes['static']
+    prot =  node.attributes['prot']
     return (kind, static, prot)
 
+def element_text(element, tagname):
+    """The ElementTree equivalent of get_text_for_element for a direct child"""
+    return ''.join(''.join(child.itertext()) for child in element.findall(tagname))
+
+def element_file_location(element):
+    location = element.find('location')
+    if location is not None: return location.attrib['file']
+    if debug: print('no location in:', element)
+    return None
+
+class MemberDef:
+    """The parts of a <memberdef> that parse_member_def looks at, read from
+    either a DOM node or an ElementTree element"""
+    def __init__(self, attributes, name, argsstring, location, is_template):
+        self.attributes = attributes
+        self.name = name
+        self.argsstring = argsstring    # None if there is no <argsstring>
+        self.location = location
+        self.is_template = is_template
+
+    @classmethod
+    def from_node(cls, node):
+        argsstring = None
+        if has_element(node, ['argsstring']): argsstring = get_text_for_element(node, 'argsstring')
+        return cls(
+            dict(node.attributes.items()),
+            concat_text_from_tags(node, ['name']),
+            argsstring,
+            get_file_location(node),
+            has_element(node, ['templateparamlist']))
+
+    @classmethod
+    def from_element(cls, element):
+        argsstring = None
+        if element.find('argsstring') is not None: argsstring = element_text(element, 'argsstring')
+        return cls(
+            dict(element.attrib),
+            element_text(element, 'name'),
+            argsstring,
+            element_file_location(element),
+            element.find('templateparamlist') is not None)
+
+class CompoundDef:
+    """The parts of a <compounddef> that parse_compound_def looks at"""
+    def __init__(self, attributes, name, location, is_template, members):
+        self.attributes = attributes
+        self.name = name
+        self.location = location
+        self.is_template = is_template
+        self.members = members
+
+    @classmethod
+    def from_node(cls, node):
+        return cls(
+            dict(node.attributes.items()),
+            concat_text_from_tags(node, ['compoundname']),
+            get_file_location(node),
+            has_element(node, ['templateparamlist']),
+            (MemberDef.from_node(member) for member in node.getElementsByTagName('memberdef')))
+
 def is_file_publishable(file_location):
     return file_location.startswith('include/') \
            or 'build/src' in file_location
@@ -72,32 +153,108 @@ publish_special_cases = {
     'mir::SharedLibrary::load_symbol*',
 }
 
-component_map = {}
+class SymbolStore:
+    """The public and private symbols found for each component.
+
+    Symbols are interned as they are added. If spill_after is set, whenever that
+    many symbols are held they are written out as sorted runs to a temporary
+    directory, and symbols() merges the runs back into a single sorted stream,
+    so the memory used doesn't grow with the size of the input."""
+    keys = ['public', 'private']
+
+    def __init__(self, spill_after = None):
+        self.spill_after = spill_after
+        self.held = {}      # component -> {key: set of symbols}
+        self.held_count = 0
+        self.runs = {}      # (component, key) -> [sorted run files]
+        self.spill_dir = None
+
+    def add(self, component, key, symbol):
+        symbols = self.held.setdefault(component, {name: set() for name in self.keys})[key]
+        if symbol in symbols: return
+        symbols.add(sys.intern(symbol))
+        self.held_count += 1
+        if self.spill_after is not None and self.held_count >= self.spill_after: self.spill()
+
+    def spill(self):
+        if self.spill_dir is None:
+            self.spill_dir = tempfile.TemporaryDirectory(prefix='process_doxygen_xml-')
+        for component, held in self.held.items():
+            for key, symbols in held.items():
+                if not symbols: continue
+                runs = self.runs.setdefault((component, key), [])
+                run = os.path.join(self.spill_dir.name, '{}-{}-{}'.format(component, key, len(runs)))
+                with open(run, 'w') as f:
+                    for symbol in sorted(symbols): f.write(symbol + '\n')
+                runs.append(run)
+                symbols.clear()
+        self.held_count = 0
+
+    def components(self):
+        return list(self.held.keys())
+
+    def symbols(self, component, key):
+        """Yields the component's symbols in sorted order, each once"""
+        held = self.held.get(component, {}).get(key, ())
+        files = [open(run) for run in self.runs.get((component, key), [])]
+        try:
+            streams = [sorted(held)] + [(line[:-1] for line in f) for f in files]
+            previous = None
+            for symbol in heapq.merge(*streams):
+                if symbol != previous: yield symbol
+                previous = symbol
+        finally:
+            for f in files: f.close()
+
+    def close(self):
+        if self.spill_dir is not None: self.spill_dir.cleanup()
+        self.spill_dir = None
+
+component_map = SymbolStore()
 
 def report(component, publish, symbol):
     symbol = symbol.replace('~', '?')
 
     if symbol in publish_special_cases: publish = True
 
-    symbols = component_map.get(component, {'public' : set(), 'private' : set()})
-    if publish: symbols['public'].add(symbol)
-    else:       symbols['private'].add(symbol)
-    component_map[component] = symbols
+    component_map.add(component, 'public' if publish else 'private', symbol)
     if not debug: return
-    if publish: print '  PUBLISH in {}: {}'.format(component, symbol)
-    else      : print 'NOPUBLISH in {}: {}'.format(component, symbol)
+    if publish: print('  PUBLISH in {}: {}'.format(component, symbol))
+    else      : print('NOPUBLISH in {}: {}'.format(component, symbol))
 
 def print_report():
     format = '{} {}: {};'
-    for component, symbols in component_map.iteritems():
-        print 'COMPONENT:', component
-        for key in symbols.keys():
-            for symbol in symbols[key]: print format.format(component, key, symbol)
-        print
+    for component in component_map.components():
+        print('COMPONENT:', component)
+        for key in SymbolStore.keys:
+            for symbol in component_map.symbols(component, key): print(format.format(component, key, symbol))
+        print()
+
+def symbol_map_components(source_dir):
+    """Maps the component name used in component_map (e.g. mirserver) to the
+    source directory of each library that has a symbols.map (e.g. server)"""
+    components = {}
+    for symbol_map in glob.glob(os.path.join(source_dir, '*', 'symbols.map')):
+        directory = os.path.basename(os.path.dirname(symbol_map))
+        components['mir' + directory] = directory
+    return components
+
+def write_symbol_maps(output_dir, source_dir):
+    """Writes the public symbols of every library that has a symbols.map to
+    OUTPUT_DIR/<library>.symbols.map, in the form used in symbols.map"""
+    os.makedirs(output_dir, exist_ok=True)
+    for component, directory in sorted(symbol_map_components(source_dir).items()):
+        candidate = os.path.join(output_dir, directory + '.symbols.map')
+        count = 0
+        with open(candidate, 'w') as f:
+            for symbol in component_map.symbols(component, 'public'):
+                f.write('    {};\n'.format(symbol))
+                count += 1
+        print('{}: {} public symbols'.format(candidate, count))
 
 def print_debug_info(node, attributes):
     if not debug: return
-    print
+    print()
     print_attribs(node, attributes)
     print_location(node)
 
@@ -107,7 +264,7 @@ def find_physical_component(location_file):
     for element in path_elements:
         if found: return element
         found = element in ['include', 'src']
-    if debug: print 'no component in:', location_file
+    if debug: print('no component in:', location_file)
     return None
 
 def mapped_physical_component(location_file):
@@ -115,95 +272,161 @@ def mapped_physical_component(location_file):
     return 'mir' + location
 
 def parse_member_def(context_name, node, is_class):
-    library = mapped_physical_component(get_file_location(node))
+    library = mapped_physical_component(node.location)
     (kind, static, prot) = get_attribs(node)
 
     if kind in ['enum', 'typedef']: return
-    if has_element(node, ['templateparamlist']): return
-    if kind in ['function'] and node.attributes['inline'].value == 'yes': return
+    if node.is_template: return
+    if kind in ['function'] and node.attributes['inline'] == 'yes': return
 
-    name = concat_text_from_tags(node, ['name'])
+    name = node.name
     if name in ['__attribute__']:
-        if debug: print '  ignoring doxygen mis-parsing:', concat_text_from_tags(node, ['argsstring'])
+        if debug: print('  ignoring doxygen mis-parsing:', node.argsstring)
         return
 
     if name.startswith('operator'): name = 'operator'
     if not context_name == None: symbol = context_name + '::' + name
     else: symbol = name
 
-    file_location = get_file_location(node)
+    file_location = node.location
     publish = is_file_publishable(file_location)
 
     is_function = kind == 'function'
     if publish: publish = kind != 'define'
     if publish and is_class: publish = is_function or static == 'yes'
     if publish and prot == 'private':
-        if is_function: publish = node.attributes['virt'].value == 'virtual'
+        if is_function: publish = node.attributes['virt'] == 'virtual'
         else: publish =  False
 
-    if publish and has_element(node, ['argsstring']):
-        publish = not get_text_for_element(node, 'argsstring').endswith('=0')
+    if publish and node.argsstring is not None:
+        publish = not node.argsstring.endswith('=0')
 
     if is_function: print_debug_info(node, ['kind', 'prot', 'static', 'virt'])
     else: print_debug_info(node, ['kind', 'prot', 'static'])
-    if debug: print '  is_class:', is_class
+    if debug: print('  is_class:', is_class)
     report(library, publish, symbol+'*')
-    if is_function and node.attributes['virt'].value == 'virtual': report(library, publish, 'non-virtual?thunk?to?'+symbol+'*')
+    if is_function and node.attributes['virt'] == 'virtual': report(library, publish, 'non-virtual?thunk?to?'+symbol+'*')
 
-def parse_compound_defs(xmldoc):
-    compounddefs = xmldoc.getElementsByTagName('compounddef')
-    for node in compounddefs:
-        kind = node.attributes['kind'].value
+def is_skipped_compound_kind(kind):
+    return kind in ['page', 'file', 'example', 'union']
 
-        if kind in ['page', 'file', 'example', 'union']: continue
+def parse_compound_def(node):
+    kind = node.attributes['kind']
 
-        if kind in ['group']:
-            for member in node.getElementsByTagName('memberdef') :
-                parse_member_def(None, member, False)
-            continue
+    if is_skipped_compound_kind(kind): return
 
-        if kind in ['namespace']:
-            symbol = concat_text_from_tags(node, ['compoundname'])
-            for member in node.getElementsByTagName('memberdef') :
-                parse_member_def(symbol, member, False)
-            continue
+    if kind in ['group']:
+        for member in node.members :
+            parse_member_def(None, member, False)
+        return
 
-        file = get_file_location(node)
-        if debug: print '  from file:', file
-        if '/examples/' in file or '/test/' in file or '[generated]' in file or '[STL]' in file:
-            continue
+    if kind in ['namespace']:
+        symbol = node.name
+        for member in node.members :
+            parse_member_def(symbol, member, False)
+        return
 
-        if has_element(node, ['templateparamlist']): continue
+    file = node.location
+    if debug: print('  from file:', file)
+    if '/examples/' in file or '/test/' in file or '[generated]' in file or '[STL]' in file:
+        return
 
-        library = mapped_physical_component(file)
-        symbol = concat_text_from_tags(node, ['compoundname'])
+    if node.is_template: return
 
-        file_location = get_file_location(node)
-        publish = is_file_publishable(file_location)
+    library = mapped_physical_component(file)
+    symbol = node.name
 
-        if publish:
-            if kind in ['class', 'struct']:
-                prot =  node.attributes['prot'].value
-                publish = prot != 'private'
-                print_debug_info(node, ['kind', 'prot'])
-                report(library, publish, 'vtable?for?' + symbol)
-                report(library, publish, 'typeinfo?for?' + symbol)
+    file_location = node.location
+    publish = is_file_publishable(file_location)
+
+    if publish:
+        if kind in ['class', 'struct']:
+            prot =  node.attributes['prot']
+            publish = prot != 'private'
+            print_debug_info(node, ['kind', 'prot'])
+            report(library, publish, 'vtable?for?' + symbol)
+            report(library, publish, 'typeinfo?for?' + symbol)
 
-        if publish:
-            for member in node.getElementsByTagName('memberdef') :
-                parse_member_def(symbol, member, kind in ['class', 'struct'])
+    if publish:
+        for member in node.members :
+            parse_member_def(symbol, member, kind in ['class', 'struct'])
+
+def parse_compound_defs(xmldoc):
+    for node in xmldoc.getElementsByTagName('compounddef'):
+        parse_compound_def(CompoundDef.from_node(node))
+
+def stream_compound_defs(filename):
+    """Parses the <compounddef>s in filename without building a DOM: each
+    <memberdef> is reduced to a MemberDef and discarded as soon as it is read"""
+    kind = None
+    members = []
+    for event, element in ElementTree.iterparse(filename, events=('start', 'end')):
+        if event == 'start':
+            if element.tag == 'compounddef':
+                kind = element.get('kind')
+                members = []
+            continue
+
+        if element.tag == 'memberdef':
+            if kind is not None and not is_skipped_compound_kind(kind):
+                members.append(MemberDef.from_element(element))
+            element.clear()
+        elif element.tag == 'compounddef':
+            compound = CompoundDef(
+                dict(element.attrib),
+                element_text(element, 'compoundname'),
+                element_file_location(element),
+                element.find('templateparamlist') is not None,
+                members)
+            kind = None
+            members = []
+            element.clear()
+            parse_compound_def(compound)
+
+def peak_memory_mib():
+    """The peak resident set size of this process (Linux reports ru_maxrss in KiB)"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
 
 if __name__ == "__main__":
     if len(argv) == 1 or '-h' in argv or '--help' in argv:
-        print helptext
+        print(helptext)
         exit()
 
-    for arg in argv[1:]:
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('--output-dir')
+    parser.add_argument('--source-dir', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+    parser.add_argument('--low-memory', action='store_true')
+    parser.add_argument('--spill-after', type=int, default=100000)
+    parser.add_argument('--memory-budget', type=float)
+    parser.add_argument('files', nargs='*')
+    args = parser.parse_args()
+
+    if args.low_memory: component_map = SymbolStore(args.spill_after)
+
+    for arg in args.files:
         try:
-            if debug: print 'Processing:', arg
-            xmldoc = minidom.parse(arg)
-            parse_compound_defs(xmldoc)
+            if debug: print('Processing:', arg)
+            if args.low_memory:
+                stream_compound_defs(arg)
+            else:
+                xmldoc = minidom.parse(arg)
+                parse_compound_defs(xmldoc)
+                xmldoc.unlink()
         except Exception as error:
-            print 'Error:', arg, error
-
-    print_report()
+            print('Error:', arg, error)
+
+    try:
+        if args.output_dir is None:
+            print_report()
+        else:
+            write_symbol_maps(args.output_dir, args.source_dir)
+    finally:
+        component_map.close()
+
+    if args.low_memory or args.memory_budget is not None:
+        peak = peak_memory_mib()
+        if args.memory_budget is None:
+            print('Peak memory: {:.1f} MiB'.format(peak), file=sys.stderr)
+        else:
+            print('Peak memory: {:.1f} MiB (budget {:.1f} MiB)'.format(peak, args.memory_budget), file=sys.stderr)
+            if peak > args.memory_budget: exit(1)
@@ -15,34 +15,38 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import sys
+import argparse
+import concurrent.futures
+import glob
+import json
 import os
 import re
-import subprocess
+import sys
+import tempfile
+import time
+from debian_symbols import (
+    DebianSymbolsFile, SymbolsEntry, VERSION_NODE, read_lines, split_name_and_types, width_independent_types)
+from demangle import Demangler, default_cache_path
+from elf_symbols import ElfFile, read_dynamic_symbols
+from symbol_snapshot import Snapshot, diff_snapshots, write_snapshot
 
-def run_get_output(args):
-    return subprocess.run(
-        args,
-        capture_output=True,
-        encoding='utf-8',
-        check=True).stdout
+NOT_ALPHANUMERIC = re.compile(r'[^A-Za-z0-9]')
+DOTTED_VERSION = re.compile(r'[\d\.]+')
 
 def canonicalize_lib_name(name):
-    return re.sub(r'[^A-Za-z0-9]', '', name.lower())
-
-def split_name_and_types(sym):
-    parts = re.split(r'([\(<])', sym)
-    name = parts[0]
-    types = ''.join(parts[1:])
-    return name, types
+    return NOT_ALPHANUMERIC.sub('', name.lower())
 
 def print_sym_set(s, text):
     print()
     print(str(len(s)) + ' ' + text + ':')
-    for sym in s:
+    for sym in sorted(s):
         print('  ' + str(sym))
 
 class Symbol:
+    '''A symbol, compared and hashed by its name, types, library and version. The
+    prefix (e.g. "(c++|arch-bits=32)", or "" for a C symbol) is not part of its identity'''
+    __slots__ = ('prefix', 'name', 'types', 'lib_id', 'version')
+
     def __init__(self, prefix, name, types, lib_id, version):
         self.prefix = prefix
         self.name = name
@@ -50,98 +54,457 @@ class Symbol:
         self.lib_id = lib_id
         self.version = version
 
+    def key(self):
+        return (self.name, self.types, self.lib_id, self.version)
+
+    def is_cpp(self):
+        return 'c++' in self.prefix.strip('()').split('|')
+
+    def __eq__(self, other):
+        return isinstance(other, Symbol) and self.key() == other.key()
+
+    def __hash__(self):
+        return hash(self.key())
+
+    def __lt__(self, other):
+        return self.key() < other.key()
+
     def __str__(self):
         return self.prefix + '"' + self.name + self.types + '@' + self.lib_id + '_' + self.version + '"'
 
-def dict_contains(d, symbol):
-    if not symbol.name in d:
-        return False
-    for candidate in d[symbol.name]:
-        if (candidate.name == symbol.name and
-            candidate.types == symbol.types and
-            candidate.lib_id == symbol.lib_id and
-            candidate.version == symbol.version
-        ):
-            return True
-    return False
-
-assert len(sys.argv) == 2, 'wrong number of args, just provide path to .so with symbols you want to scan'
-lib_path = os.path.realpath(sys.argv[1])
-assert os.path.isfile(lib_path), lib_path + ' is not a file'
-groups = re.search(r'(lib[^/]*)\.so\.(\d+)', lib_path)
-assert groups, 'could not guess debian symbols file name from ' + lib_path
-lib_name = groups.group(1)
-so_version = int(groups.group(2))
-debian_symbols_path = os.path.join(
-    os.path.dirname(os.path.dirname(__file__)),
-    'debian',
-    lib_name + str(so_version) + '.symbols')
-assert os.path.isfile(debian_symbols_path), debian_symbols_path + ' is not a file'
-raw_nm = run_get_output(['nm', '-D', lib_path])
-lib_symbols = {}
-for raw_line in raw_nm.splitlines():
-    if '@' in raw_line:
-        groups = re.search(
-            r' (?P<type>\w) (?P<c_sym>[^\n@]*)@+(?P<lib>[\w]+)_(?P<version>[\d\.]+)',
-            raw_line)
-        assert groups, 'could not parse nm line: ' + raw_line
-        c_sym = groups.group('c_sym')
-        lib_id = groups.group('lib')
-        version = groups.group('version')
-        cpp_sym = run_get_output(['c++filt', c_sym]).strip()
-        cpp_name, cpp_types = split_name_and_types(cpp_sym)
-        if canonicalize_lib_name(lib_id) in canonicalize_lib_name(lib_name):
-            lib_symbols.setdefault(cpp_name, [])
-            lib_symbols[cpp_name].append(
-                Symbol('(c++)', cpp_name, cpp_types, lib_id, version))
-print('read ' + str(len(lib_symbols)) + ' symbols from ' + lib_path)
-print('parsing ' + debian_symbols_path)
-with open(debian_symbols_path, 'r') as f:
-    debian_symbols_raw = f.read()
-debian_symbols = {}
-for raw_line in debian_symbols_raw.splitlines():
-    cpp_groups = re.search(
-        r'(?P<prefix>\(c\+\+.*\))"(?P<cpp_sym>[^@]*)@(?P<lib>\w+)_(?P<version>[\d\.]+)" (?P<outer_version>[\d\.]+)',
-        raw_line)
-    if raw_line.strip().startswith('#'):
-        pass
-    elif cpp_groups:
-        prefix = cpp_groups.group('prefix')
-        cpp_sym = cpp_groups.group('cpp_sym')
-        cpp_name, cpp_types = split_name_and_types(cpp_sym)
-        lib_id = cpp_groups.group('lib')
-        version = cpp_groups.group('version')
-        outer_version = cpp_groups.group('outer_version')
-        if not outer_version.startswith(version):
-            print(
-                'WARNING: ' + cpp_sym +
-                ' in ' + debian_symbols_path +
-                ' has mismatched versions (inner version: ' +
-                version + ', outer version: ' +
-                outer_version + ')')
-        debian_symbols.setdefault(cpp_name, [])
-        debian_symbols[cpp_name].append(
-            Symbol(prefix, cpp_name, cpp_types, lib_id, version))
-    else:
-        print('could not parse "' + raw_line + '" in ' + debian_symbols_path)
-only_in_debian = set()
-only_in_debian_32_bit = set()
-in_both = set()
-for syms in debian_symbols.values():
-    for sym in syms:
-        if dict_contains(lib_symbols, sym):
-            in_both.add(sym)
-        elif 'arch-bits=32' in sym.prefix:
-            only_in_debian_32_bit.add(sym)
+    def to_json(self):
+        return {
+            'symbol': str(self),
+            'prefix': self.prefix,
+            'name': self.name,
+            'types': self.types,
+            'lib_id': self.lib_id,
+            'version': self.version,
+        }
+
+DEBIAN_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'debian')
+
+def library_name_and_so_version(lib_path):
+    groups = re.search(r'(lib[^/]*)\.so\.(\d+)', lib_path)
+    assert groups, 'could not guess debian symbols file name from ' + lib_path
+    return groups.group(1), int(groups.group(2))
+
+def debian_symbols_path_for(lib_path):
+    lib_name, so_version = library_name_and_so_version(lib_path)
+    return os.path.join(DEBIAN_DIR, lib_name + str(so_version) + '.symbols')
+
+def find_libraries(build_lib_dir):
+    '''Returns the real paths of the versioned shared libraries (lib*.so.N) in build_lib_dir'''
+    libraries = []
+    for path in sorted(glob.glob(os.path.join(build_lib_dir, 'lib*.so.*'))):
+        if re.fullmatch(r'lib[^/]*\.so\.\d+', os.path.basename(path)):
+            real_path = os.path.realpath(path)
+            if os.path.isfile(real_path) and real_path not in libraries:
+                libraries.append(real_path)
+    return libraries
+
+def read_versioned_symbols(lib_path):
+    '''Returns (name, lib_id, version, mangled) for each symbol with a LIB_X.Y version,
+    where mangled is False for a C symbol (one that c++filt leaves as it is)'''
+    versioned_symbols = []
+    for elf_symbol in read_dynamic_symbols(lib_path):
+        # Skip unversioned symbols and the symbols naming each version node
+        if elf_symbol.version is not None and elf_symbol.version != elf_symbol.name:
+            groups = VERSION_NODE.fullmatch(elf_symbol.version)
+            if not groups:
+                continue # e.g. GLIBC_PRIVATE, never one of the library's own versions
+            versioned_symbols.append(
+                (elf_symbol.name, groups.group('lib'), groups.group('version'), elf_symbol.name.startswith('_Z')))
+    return versioned_symbols
+
+def read_debian_symbols(debian_symbols_path):
+    '''Returns the symbols in a debian .symbols file and the warnings about its contents'''
+    debian_symbols = []
+    warnings = []
+    for line in read_lines(debian_symbols_path):
+        groups = None
+        if isinstance(line, SymbolsEntry) and not line.is_version_marker() and line.version is not None:
+            groups = VERSION_NODE.fullmatch(line.version)
+        if isinstance(line, str) and line.strip().startswith('#'):
+            pass
+        elif groups and DOTTED_VERSION.fullmatch(line.min_version):
+            cpp_name, cpp_types = split_name_and_types(line.name)
+            lib_id = groups.group('lib')
+            version = groups.group('version')
+            if not line.min_version.startswith(version):
+                warnings.append(
+                    'WARNING: ' + line.name +
+                    ' in ' + debian_symbols_path +
+                    ' has mismatched versions (inner version: ' +
+                    version + ', outer version: ' +
+                    line.min_version + ')')
+            debian_symbols.append(Symbol(line.prefix(), cpp_name, cpp_types, lib_id, version))
         else:
-            only_in_debian.add(sym)
-only_in_lib = set()
-for syms in lib_symbols.values():
-    for sym in syms:
-        if not dict_contains(debian_symbols, sym):
-            only_in_lib.add(sym)
-print()
-print(str(len(in_both)) + ' in both library and .symbols file.')
-print_sym_set(only_in_debian_32_bit, '32-bit symbols only in .symbols file')
-print_sym_set(only_in_debian, 'symbols in only the .symbols file')
-print_sym_set(only_in_lib, 'symbols in only the library')
+            warnings.append('could not parse "' + str(line) + '" in ' + debian_symbols_path)
+    return debian_symbols, warnings
+
+def read_library(lib_path):
+    '''Reads everything a scan needs from the library and its debian .symbols file.
+    This is the slow part of a scan, so with --all it runs in a worker process'''
+    debian_symbols, warnings = read_debian_symbols(debian_symbols_path_for(lib_path))
+    return read_versioned_symbols(lib_path), debian_symbols, warnings
+
+def library_symbols(lib_path, versioned_symbols, cpp_syms):
+    '''Returns the Symbols with one of the library's own versions (e.g. MIRAL_5.0 for libmiral)'''
+    lib_name, _ = library_name_and_so_version(lib_path)
+    canonical_lib_name = canonicalize_lib_name(lib_name)
+    own_lib_ids = {}
+    lib_symbols = set()
+    for (_, lib_id, version, mangled), cpp_sym in zip(versioned_symbols, cpp_syms):
+        if lib_id not in own_lib_ids:
+            own_lib_ids[lib_id] = canonicalize_lib_name(lib_id) in canonical_lib_name
+        if own_lib_ids[lib_id]:
+            cpp_name, cpp_types = split_name_and_types(cpp_sym)
+            lib_symbols.add(Symbol('(c++)' if mangled else '', cpp_name, cpp_types, lib_id, version))
+    return lib_symbols
+
+class Scan:
+    '''The symbols in both a library and its debian .symbols file, and in only one of them'''
+    def __init__(self, lib_path, versioned_symbols, cpp_syms, debian_symbols):
+        self.lib_path = lib_path
+        self.debian_symbols_path = debian_symbols_path_for(lib_path)
+        self.lib_symbols = library_symbols(lib_path, versioned_symbols, cpp_syms)
+        self.in_both = {sym for sym in debian_symbols if sym in self.lib_symbols}
+        self.only_in_debian_32_bit = {
+            sym for sym in debian_symbols if sym not in self.lib_symbols and 'arch-bits=32' in sym.prefix}
+        self.only_in_debian = {
+            sym for sym in debian_symbols if sym not in self.lib_symbols and not 'arch-bits=32' in sym.prefix}
+        self.only_in_lib = self.lib_symbols - set(debian_symbols)
+
+    def print_report(self, warnings):
+        print('read ' + str(len(self.lib_symbols)) + ' symbols from ' + self.lib_path)
+        print('parsing ' + self.debian_symbols_path)
+        for warning in warnings:
+            print(warning)
+        print()
+        print(str(len(self.in_both)) + ' in both library and .symbols file.')
+        print_sym_set(self.only_in_debian_32_bit, '32-bit symbols only in .symbols file')
+        print_sym_set(self.only_in_debian, 'symbols in only the .symbols file')
+        print_sym_set(self.only_in_lib, 'symbols in only the library')
+
+    def to_json(self):
+        return {
+            'library': self.lib_path,
+            'symbols_file': self.debian_symbols_path,
+            'in_both': len(self.in_both),
+            'only_in_symbols_file_32_bit': [sym.to_json() for sym in sorted(self.only_in_debian_32_bit)],
+            'only_in_symbols_file': [sym.to_json() for sym in sorted(self.only_in_debian)],
+            'only_in_library': [sym.to_json() for sym in sorted(self.only_in_lib)],
+        }
+
+def scan_libraries(lib_paths, jobs):
+    '''Scans the libraries, reading them on a pool of worker processes (jobs of them, or
+    one per CPU if None) when there is more than one. The names from all the libraries
+    are demangled in one batch. Returns a (Scan, warnings) for each library'''
+    if len(lib_paths) > 1:
+        with concurrent.futures.ProcessPoolExecutor(jobs) as pool:
+            libraries = list(pool.map(read_library, lib_paths))
+    else:
+        libraries = [read_library(lib_path) for lib_path in lib_paths]
+    demangler = Demangler(default_cache_path())
+    cpp_syms = demangler.demangle_all(
+        [c_sym for versioned_symbols, _, _ in libraries for c_sym, _, _, _ in versioned_symbols])
+    demangler.save()
+    scans = []
+    start = 0
+    for lib_path, (versioned_symbols, debian_symbols, warnings) in zip(lib_paths, libraries):
+        end = start + len(versioned_symbols)
+        scans.append((Scan(lib_path, versioned_symbols, cpp_syms[start:end], debian_symbols), warnings))
+        start = end
+    return scans
+
+def print_summary(scans, skipped):
+    print()
+    print('Summary:')
+    for scan, _ in scans:
+        print('  {:32} {:6} in both {:6} only in .symbols file {:6} only in library'.format(
+            os.path.basename(scan.lib_path), len(scan.in_both),
+            len(scan.only_in_debian) + len(scan.only_in_debian_32_bit), len(scan.only_in_lib)))
+    for lib_path in skipped:
+        print('  {:32} skipped, there is no {}'.format(os.path.basename(lib_path), debian_symbols_path_for(lib_path)))
+
+def read_library_for_arch(lib_path):
+    '''Reads the versioned symbols and the word size of a library built for one architecture'''
+    with ElfFile(lib_path) as elf:
+        bits = elf.bits
+    return read_versioned_symbols(lib_path), bits
+
+class MultiArchScan:
+    '''The symbols of one library built for several architectures: those exported on all of them,
+    those that differ only in the widths of integer types (e.g. an int64_t parameter being a long on
+    64 bit and a long long on 32 bit architectures) and those exported on only some of them'''
+    def __init__(self, lib_paths, bits, lib_symbols, debian_symbols_file):
+        self.lib_paths = lib_paths    # architecture -> library path, in the order given
+        self.bits = bits              # architecture -> word size
+        self.lib_symbols = lib_symbols  # architecture -> set of Symbols
+        self.debian_symbols_file = debian_symbols_file
+        arches = list(lib_paths)
+        self.arches_of = {}
+        for arch in arches:
+            for sym in lib_symbols[arch]:
+                self.arches_of.setdefault(sym, []).append(arch)
+        self.common = {sym for sym, sym_arches in self.arches_of.items() if len(sym_arches) == len(arches)}
+        groups = {}
+        for sym, sym_arches in self.arches_of.items():
+            if len(sym_arches) < len(arches):
+                key = (sym.name, width_independent_types(sym.types), sym.lib_id, sym.version)
+                groups.setdefault(key, []).append(sym)
+        self.width_variants = []    # lists of Symbols, each exported on a different set of architectures
+        self.arch_specific = set()
+        for group in groups.values():
+            group_arches = [arch for sym in group for arch in self.arches_of[sym]]
+            if len(group) > 1 and sorted(group_arches) == sorted(arches):
+                self.width_variants.append(sorted(group))
+            else:
+                self.arch_specific.update(group)
+        self.width_variants.sort()
+
+    def tags(self, sym):
+        '''The tags for sym's line in the debian .symbols file. Width variants are tagged with
+        arch-bits=N when they are exported on exactly the architectures with that word size. Only
+        C++ symbols are tagged c++, as dpkg-gensymbols would not find a C symbol's demangled name'''
+        sym_arches = self.arches_of[sym]
+        language = ['c++'] if sym.is_cpp() else []
+        if sym in self.common:
+            return language
+        if sym not in self.arch_specific:
+            for bits in sorted(set(self.bits.values())):
+                if sorted(sym_arches) == sorted(arch for arch in self.lib_paths if self.bits[arch] == bits):
+                    return language + ['arch-bits=' + str(bits)]
+        return language + ['arch=' + ' '.join(sym_arches)]
+
+    def entry(self, sym):
+        '''The line for sym in the debian .symbols file, with the minimal version already in it
+        or else the first release with its version node'''
+        version = sym.lib_id + '_' + sym.version
+        existing = self.debian_symbols_file.find(sym.name + sym.types, version) if self.debian_symbols_file else []
+        min_version = existing[0].min_version if existing else sym.version + '.0'
+        return SymbolsEntry(self.tags(sym), sym.name + sym.types, version, min_version)
+
+    def symbols_file(self, lib_path):
+        '''Returns a DebianSymbolsFile listing every symbol, tagged for the architectures that export it'''
+        lib_name, so_version = library_name_and_so_version(lib_path)
+        symbols_file = DebianSymbolsFile([
+            os.path.basename(lib_path) + ' ' + lib_name + str(so_version) + ' #MINVER#'])
+        entries = [self.entry(sym) for sym in self.arches_of]
+        versions = sorted({sym.version: sym.lib_id + '_' + sym.version for sym in self.arches_of}.items(),
+                          key=lambda version: [int(n) for n in version[0].split('.')])
+        for _, version in versions:
+            symbols_file.merge(self.version_marker(version), [entry for entry in entries if entry.version == version])
+        return symbols_file
+
+    def version_marker(self, version):
+        if self.debian_symbols_file is not None:
+            for block in self.debian_symbols_file.blocks:
+                if block.marker is not None and block.marker.version == version:
+                    return block.marker
+        return SymbolsEntry([], version, version, version.split('_')[-1] + '.0')
+
+    def print_report(self):
+        for arch, lib_path in self.lib_paths.items():
+            print('read ' + str(len(self.lib_symbols[arch])) + ' symbols from ' + lib_path +
+                  ' (' + arch + ', ' + str(self.bits[arch]) + ' bit)')
+        print()
+        print(str(len(self.common)) + ' on all architectures.')
+        print()
+        print(str(len(self.width_variants)) + ' that differ only in the widths of integer types:')
+        for group in self.width_variants:
+            for sym in group:
+                print('  ' + str(self.entry(sym)).strip())
+        print()
+        print(str(len(self.arch_specific)) + ' on only some architectures:')
+        for sym in sorted(self.arch_specific):
+            print('  ' + str(self.entry(sym)).strip())
+
+    def to_json(self):
+        def arch_symbol(sym):
+            result = sym.to_json()
+            result['architectures'] = self.arches_of[sym]
+            result['line'] = str(self.entry(sym))
+            return result
+        return {
+            'architectures': {
+                arch: {'library': lib_path, 'bits': self.bits[arch], 'symbols': len(self.lib_symbols[arch])}
+                for arch, lib_path in self.lib_paths.items()},
+            'common': len(self.common),
+            'width_variants': [[arch_symbol(sym) for sym in group] for group in self.width_variants],
+            'arch_specific': [arch_symbol(sym) for sym in sorted(self.arch_specific)],
+        }
+
+def scan_architectures(lib_paths, jobs):
+    '''Scans a library built for several architectures (lib_paths maps each to its build of the
+    library). The libraries are read in parallel and all their names demangled in one batch'''
+    with concurrent.futures.ProcessPoolExecutor(jobs) as pool:
+        libraries = list(pool.map(read_library_for_arch, lib_paths.values()))
+    demangler = Demangler(default_cache_path())
+    cpp_syms = demangler.demangle_all(
+        [c_sym for versioned_symbols, _ in libraries for c_sym, _, _, _ in versioned_symbols])
+    demangler.save()
+    bits = {}
+    lib_symbols = {}
+    start = 0
+    for (arch, lib_path), (versioned_symbols, arch_bits) in zip(lib_paths.items(), libraries):
+        end = start + len(versioned_symbols)
+        bits[arch] = arch_bits
+        lib_symbols[arch] = library_symbols(lib_path, versioned_symbols, cpp_syms[start:end])
+        start = end
+    debian_symbols_path = debian_symbols_path_for(next(iter(lib_paths.values())))
+    debian_symbols_file = DebianSymbolsFile.read(debian_symbols_path) if os.path.isfile(debian_symbols_path) else None
+    return MultiArchScan(lib_paths, bits, lib_symbols, debian_symbols_file)
+
+def snapshot_name(lib_path):
+    lib_name, so_version = library_name_and_so_version(lib_path)
+    return lib_name + '.so.' + str(so_version)
+
+def write_scan_snapshot(path, scan):
+    write_snapshot(path, snapshot_name(scan.lib_path), [sym.key() for sym in scan.lib_symbols])
+
+def diff_snapshot_files(old_path, new_path):
+    '''Prints (and returns as JSON) the symbols in only one of two snapshots'''
+    with Snapshot(old_path) as old, Snapshot(new_path) as new:
+        removed, added = diff_snapshots(old, new)
+        print(str(len(old)) + ' symbols in ' + old.library + ' (' + old_path + ')')
+        print(str(len(new)) + ' symbols in ' + new.library + ' (' + new_path + ')')
+    removed = [Symbol('(c++)', *key) for key in removed]
+    added = [Symbol('(c++)', *key) for key in added]
+    print_sym_set(removed, 'symbols only in ' + old_path)
+    print_sym_set(added, 'symbols only in ' + new_path)
+    return {
+        'old': old_path,
+        'new': new_path,
+        'only_in_old': [sym.to_json() for sym in removed],
+        'only_in_new': [sym.to_json() for sym in added],
+    }
+
+def check_symbols_round_trip():
+    '''Checks that the .symbols file --write-symbols writes for a synthetic library with C and C++
+    symbols, some exported on only one architecture, reads back as the same symbols'''
+    versioned_symbols = {
+        'amd64': [('_ZN5miral3fooEi', 'MIRTEST', '1.0', True),
+                  ('_ZN5miral3barEl', 'MIRTEST', '1.0', True),
+                  ('mirtest_c_func', 'MIRTEST', '1.0', False),
+                  ('mirtest_c_64', 'MIRTEST', '1.1', False)],
+        'i386': [('_ZN5miral3fooEi', 'MIRTEST', '1.0', True),
+                 ('_ZN5miral3barEx', 'MIRTEST', '1.0', True),
+                 ('mirtest_c_func', 'MIRTEST', '1.0', False)],
+    }
+    demangler = Demangler()
+    lib_paths = {arch: arch + '/libmirtest.so.1' for arch in versioned_symbols}
+    lib_symbols = {
+        arch: library_symbols(lib_paths[arch], symbols, demangler.demangle_all([name for name, _, _, _ in symbols]))
+        for arch, symbols in versioned_symbols.items()}
+    multi_arch_scan = MultiArchScan(lib_paths, {'amd64': 64, 'i386': 32}, lib_symbols, None)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        symbols_path = os.path.join(temp_dir, 'libmirtest1.symbols')
+        multi_arch_scan.symbols_file(lib_paths['amd64']).write(symbols_path)
+        with open(symbols_path) as f:
+            text = f.read()
+        debian_symbols, _ = read_debian_symbols(symbols_path)
+    expected = {str(Symbol(multi_arch_scan.entry(sym).prefix(), sym.name, sym.types, sym.lib_id, sym.version))
+                for sym in multi_arch_scan.arches_of}
+    if {str(sym) for sym in debian_symbols} != expected or len(debian_symbols) != len(expected):
+        print('the symbols read back from --write-symbols do not match those written:', file=sys.stderr)
+        print(text, file=sys.stderr, end='')
+        return 1
+    if ' mirtest_c_func@MIRTEST_1.0 1.0.0\n' not in text or '(c++)"miral::foo(int)@MIRTEST_1.0" 1.0.0\n' not in text:
+        print('--write-symbols should tag only the C++ symbols c++:', file=sys.stderr)
+        print(text, file=sys.stderr, end='')
+        return 1
+    print('--write-symbols round trips ' + str(len(expected)) + ' C and C++ symbols')
+    return 0
+
+def write_json(path, report):
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+        f.write('\n')
+
+def main():
+    parser = argparse.ArgumentParser(description='Compares the symbols a library exports with its debian .symbols file')
+    parser.add_argument('library', nargs='?', help='path to the .so with the symbols you want to scan')
+    parser.add_argument('--all', metavar='BUILD_LIB_DIR',
+                        help='scan every versioned lib*.so.N in BUILD_LIB_DIR that has a debian .symbols file')
+    parser.add_argument('--lib', metavar='ARCH=PATH', action='append',
+                        help='the library built for the architecture ARCH (e.g. amd64); give more than one to '
+                             'compare the symbols each architecture exports')
+    parser.add_argument('--diff', nargs=2, metavar=('OLD_SNAPSHOT', 'NEW_SNAPSHOT'),
+                        help='compare two snapshots written by --snapshot, without the libraries')
+    parser.add_argument('--snapshot', metavar='PATH',
+                        help='also write a snapshot of the library\'s symbols to PATH (with --all, to a '
+                             'LIBRARY.snapshot file for each library in the directory PATH)')
+    parser.add_argument('--jobs', type=int, help='worker processes for --all and --lib (default: one per CPU)')
+    parser.add_argument('--json', metavar='FILE', help='also write the differences to FILE as JSON')
+    parser.add_argument('--write-symbols', metavar='FILE',
+                        help='with --lib, write a debian .symbols file with every symbol tagged for the architectures exporting it')
+    parser.add_argument('--check', action='store_true',
+                        help='check that --write-symbols round trips the C and C++ symbols of a synthetic library')
+    args = parser.parse_args()
+    if args.check:
+        sys.exit(check_symbols_round_trip())
+    if [args.library, args.all, args.lib, args.diff].count(None) != 3:
+        parser.error('give either the path to a library, --all BUILD_LIB_DIR, --lib ARCH=PATH or --diff')
+    if args.write_symbols is not None and args.lib is None:
+        parser.error('--write-symbols needs --lib')
+    if args.snapshot is not None and args.library is None and args.all is None:
+        parser.error('--snapshot needs the path to a library or --all')
+
+    if args.diff is not None:
+        report = diff_snapshot_files(*args.diff)
+        if args.json:
+            write_json(args.json, report)
+    elif args.lib is not None:
+        lib_paths = {}
+        for arg in args.lib:
+            arch, equals, lib_path = arg.partition('=')
+            if not equals or not arch or arch in lib_paths:
+                parser.error('--lib should be ARCH=PATH, with a different ARCH each time: ' + arg)
+            lib_paths[arch] = os.path.realpath(lib_path)
+            assert os.path.isfile(lib_paths[arch]), lib_path + ' is not a file'
+        names = {library_name_and_so_version(lib_path) for lib_path in lib_paths.values()}
+        assert len(names) == 1, 'the --lib libraries should all be builds of one library'
+        multi_arch_scan = scan_architectures(lib_paths, args.jobs)
+        multi_arch_scan.print_report()
+        if args.json:
+            write_json(args.json, multi_arch_scan.to_json())
+        if args.write_symbols:
+            multi_arch_scan.symbols_file(next(iter(lib_paths.values()))).write(args.write_symbols)
+    elif args.all is None:
+        lib_path = os.path.realpath(args.library)
+        assert os.path.isfile(lib_path), lib_path + ' is not a file'
+        debian_symbols_path = debian_symbols_path_for(lib_path)
+        assert os.path.isfile(debian_symbols_path), debian_symbols_path + ' is not a file'
+        [(scan, warnings)] = scan_libraries([lib_path], 1)
+        scan.print_report(warnings)
+        if args.json:
+            write_json(args.json, scan.to_json())
+        if args.snapshot:
+            write_scan_snapshot(args.snapshot, scan)
+    else:
+        assert os.path.isdir(args.all), args.all + ' is not a directory'
+        start_time = time.perf_counter()
+        lib_paths = find_libraries(args.all)
+        skipped = [lib_path for lib_path in lib_paths if not os.path.isfile(debian_symbols_path_for(lib_path))]
+        scans = scan_libraries([lib_path for lib_path in lib_paths if lib_path not in skipped], args.jobs)
+        for scan, warnings in scans:
+            print()
+            print('=== ' + os.path.basename(scan.lib_path) + ' ===')
+            scan.print_report(warnings)
+        print_summary(scans, skipped)
+        print()
+        print('scanned ' + str(len(scans)) + ' libraries in {:.1f}s'.format(time.perf_counter() - start_time))
+        if args.json:
+            write_json(args.json, {
+                'libraries': [scan.to_json() for scan, _ in scans],
+                'skipped': skipped,
+            })
+        if args.snapshot:
+            os.makedirs(args.snapshot, exist_ok=True)
+            for scan, _ in scans:
+                write_scan_snapshot(os.path.join(args.snapshot, snapshot_name(scan.lib_path) + '.snapshot'), scan)
+
+if __name__ == '__main__':
+    main()
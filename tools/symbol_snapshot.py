@@ -0,0 +1,155 @@
+#! /usr/bin/python3
+# coding: utf-8
+
+# Copyright © Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 or 3
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Reads and writes snapshots of the symbols a library exports, so that releases can
+be compared without the libraries themselves (see scan_symbols.py --snapshot and --diff).
+
+USAGE: ./symbol_snapshot.py SNAPSHOT
+
+Prints the library and symbols recorded in SNAPSHOT.
+
+A snapshot is a little-endian binary file, designed to be used through mmap():
+  header      magic "MIRSYMS\\0", format version, string count, symbol count, offset
+              of the string offsets, offset of the symbols and the string index of
+              the library's file name (all uint32 after the magic)
+  strings     each distinct string once, in sorted order, as a uint32 byte length
+              followed by the UTF-8 bytes
+  offsets     the file offset of each string (uint32)
+  symbols     four string indexes (uint32) for each symbol: its demangled name, types
+              (e.g. "(int) const"), library id (e.g. MIRAL) and version (e.g. 5.0),
+              sorted by those strings
+As the strings are sorted, the symbols sort the same way by index as by string."""
+
+import mmap
+import os
+import struct
+import sys
+
+MAGIC = b'MIRSYMS\0'
+FORMAT_VERSION = 1
+_HEADER = struct.Struct('<8sIIIIII')
+_LENGTH = struct.Struct('<I')
+_SYMBOL = struct.Struct('<IIII')
+
+def write_snapshot(path, library, symbols):
+    '''Writes a snapshot of symbols, each a (name, types, lib_id, version) tuple of strings,
+    exported by the library with the file name library'''
+    symbols = sorted(set(symbols))
+    strings = sorted({string for symbol in symbols for string in symbol} | {library})
+    index = {string: i for i, string in enumerate(strings)}
+    parts = []
+    offsets = []
+    offset = _HEADER.size
+    for string in strings:
+        encoded = string.encode('utf-8')
+        offsets.append(offset)
+        parts.append(_LENGTH.pack(len(encoded)) + encoded)
+        offset += _LENGTH.size + len(encoded)
+    offsets_offset = offset
+    symbols_offset = offsets_offset + 4 * len(offsets)
+    parts.append(struct.pack('<' + str(len(offsets)) + 'I', *offsets))
+    parts.extend(_SYMBOL.pack(*(index[string] for string in symbol)) for symbol in symbols)
+    header = _HEADER.pack(
+        MAGIC, FORMAT_VERSION, len(strings), len(symbols), offsets_offset, symbols_offset, index[library])
+    temp_path = path + '.' + str(os.getpid()) + '.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(header)
+        f.write(b''.join(parts))
+    os.replace(temp_path, path)
+
+class Snapshot:
+    '''A read-only mapping of a snapshot file, to be used as a context manager. Indexing
+    and iterating give the symbols as (name, types, lib_id, version) tuples, in sorted order'''
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if len(self.data) < _HEADER.size:
+                raise ValueError(path + ' is not a symbol snapshot')
+            (magic, version, self.string_count, self.symbol_count,
+             self.offsets_offset, self.symbols_offset, library) = _HEADER.unpack_from(self.data)
+            if magic != MAGIC:
+                raise ValueError(path + ' is not a symbol snapshot')
+            if version != FORMAT_VERSION:
+                raise ValueError(path + ' is a version ' + str(version) + ' snapshot, not version ' + str(FORMAT_VERSION))
+            if self.symbols_offset + self.symbol_count * _SYMBOL.size > len(self.data):
+                raise ValueError(path + ' is truncated')
+            self.strings = {}   # index -> string, for the strings decoded so far
+            self.library = self.string(library)
+        except Exception:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+    def close(self):
+        self.data.close()
+
+    def string(self, i):
+        if i not in self.strings:
+            (offset,) = _LENGTH.unpack_from(self.data, self.offsets_offset + 4 * i)
+            (length,) = _LENGTH.unpack_from(self.data, offset)
+            start = offset + _LENGTH.size
+            self.strings[i] = self.data[start:start + length].decode('utf-8')
+        return self.strings[i]
+
+    def __len__(self):
+        return self.symbol_count
+
+    def __getitem__(self, i):
+        if not 0 <= i < self.symbol_count:
+            raise IndexError(i)
+        return tuple(self.string(j) for j in _SYMBOL.unpack_from(self.data, self.symbols_offset + i * _SYMBOL.size))
+
+    def __iter__(self):
+        for i in range(self.symbol_count):
+            yield self[i]
+
+def diff_snapshots(old, new):
+    '''Returns the symbols only in the old Snapshot and those only in the new one, merging
+    the two sorted symbol lists in a single pass'''
+    removed = []
+    added = []
+    old_symbols = iter(old)
+    new_symbols = iter(new)
+    old_symbol = next(old_symbols, None)
+    new_symbol = next(new_symbols, None)
+    while old_symbol is not None or new_symbol is not None:
+        if new_symbol is None or (old_symbol is not None and old_symbol < new_symbol):
+            removed.append(old_symbol)
+            old_symbol = next(old_symbols, None)
+        elif old_symbol is None or new_symbol < old_symbol:
+            added.append(new_symbol)
+            new_symbol = next(new_symbols, None)
+        else:
+            old_symbol = next(old_symbols, None)
+            new_symbol = next(new_symbols, None)
+    return removed, added
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2 or sys.argv[1] in ['-h', '--help']:
+        print(__doc__)
+        sys.exit()
+    with Snapshot(sys.argv[1]) as snapshot:
+        print(snapshot.library + ': ' + str(len(snapshot)) + ' symbols')
+        for name, types, lib_id, version in snapshot:
+            print('  ' + name + types + '@' + lib_id + '_' + version)
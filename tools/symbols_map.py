@@ -0,0 +1,1016 @@
+# Copyright © Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 2 or 3
+# as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Works out which symbols a library publishes, from the XML generated by "make doc" or
+by scanning its C++ headers, and adds the new ones to its symbols.map version script.
+
+This is shared by src/miral/regenerate-miral-symbols-map.py and
+src/miroil/regenerate-miroil-symbols-map.py, which only differ in the library's
+namespace (see their --help for the options)."""
+
+import contextlib
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import time
+from xml.dom import minidom
+from xml.etree import ElementTree
+
+DEBUG = False
+
+def _get_text(node):
+    substrings = []
+    for node in node.childNodes:
+        if node.nodeType == node.TEXT_NODE:
+            substrings.append(node.data)
+        elif node.nodeType == node.ELEMENT_NODE:
+            substrings.append(_get_text(node))
+    return ''.join(substrings)
+
+def _get_text_for_element(parent, tagname):
+    substrings = []
+
+    for node in parent.getElementsByTagName(tagname):
+        substrings.append(_get_text(node))
+
+    return ''.join(substrings)
+
+def _get_file_location(node):
+    for node in node.childNodes:
+        if node.nodeType == node.ELEMENT_NODE and node.tagName == 'location':
+            return node.attributes['file'].value
+    if DEBUG:
+        print('no location in:', node)
+    return None
+
+def _has_element(node, tagname):
+    for node in node.childNodes:
+        if node.nodeType == node.ELEMENT_NODE and node.tagName in tagname:
+            return True
+    return False
+
+def _concat_text_from_tags(parent, tagnames):
+    substrings = []
+
+    for tag in tagnames:
+        substrings.append(_get_text_for_element(parent, tag))
+
+    return ''.join(substrings)
+
+class _ElementView:
+    """An ElementTree element's direct children indexed by tag in one pass, with
+    the text of each tag extracted at most once.
+
+    Doxygen puts the <name>, <argsstring>, <compoundname>, <location> and
+    <templateparamlist> that the publishing rules look at directly under the
+    <memberdef> or <compounddef>, so this replaces a rescan of the children
+    (or of the whole subtree) per lookup. The minidom engine still does those
+    searches and --check-engines compares the two."""
+    def __init__(self, element):
+        self.element = element
+        self.children = {}
+        self.texts = {}
+        for child in element:
+            self.children.setdefault(child.tag, []).append(child)
+
+    def has(self, tagname):
+        return tagname in self.children
+
+    def text(self, tagname):
+        if tagname not in self.texts:
+            self.texts[tagname] = ''.join(''.join(child.itertext()) for child in self.children.get(tagname, []))
+        return self.texts[tagname]
+
+    def file_location(self):
+        if 'location' in self.children:
+            return self.children['location'][0].attrib['file']
+        if DEBUG:
+            print('no location in:', self.element)
+        return None
+
+class _MemberDef:
+    """The parts of a Doxygen <memberdef> that decide whether it is published"""
+    def __init__(self, attributes, name, argsstring, location, is_template):
+        self.attributes = attributes
+        self.name = name
+        self.argsstring = argsstring    # None if there is no <argsstring>
+        self.location = location
+        self.is_template = is_template
+
+    @classmethod
+    def from_node(cls, node):
+        argsstring = None
+        if _has_element(node, ['argsstring']):
+            argsstring = _get_text_for_element(node, 'argsstring')
+        return cls(
+            dict(node.attributes.items()),
+            _concat_text_from_tags(node, ['name']),
+            argsstring,
+            _get_file_location(node),
+            _has_element(node, ['templateparamlist']))
+
+    @classmethod
+    def from_element(cls, element):
+        view = _ElementView(element)
+        return cls(
+            dict(element.attrib),
+            view.text('name'),
+            view.text('argsstring') if view.has('argsstring') else None,
+            view.file_location(),
+            view.has('templateparamlist'))
+
+class _CompoundDef:
+    """The parts of a Doxygen <compounddef> that decide whether it is published"""
+    def __init__(self, attributes, name, location, is_template, members):
+        self.attributes = attributes
+        self.name = name
+        self.location = location
+        self.is_template = is_template
+        self.members = members
+
+    @classmethod
+    def from_node(cls, node):
+        return cls(
+            dict(node.attributes.items()),
+            _concat_text_from_tags(node, ['compoundname']),
+            _get_file_location(node),
+            _has_element(node, ['templateparamlist']),
+            (_MemberDef.from_node(member) for member in node.getElementsByTagName('memberdef')))
+
+def _print_attribs(member, attribs):
+    for attrib in attribs:
+        print(' ', attrib, '=', member.attributes[attrib])
+
+def _print_location(member):
+    print(' ', 'location', '=', member.location)
+
+def _get_attribs(member):
+    kind = member.attributes['kind']
+    static = member.attributes['static']
+    prot = member.attributes['prot']
+    return kind, static, prot
+
+class Stats:
+    """Counters and timed phases for --stats and --trace. Recording is a no-op
+    unless enabled, so the default run doesn't pay for it."""
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.counters = {}
+        self.events = []    # Chrome trace "complete" events
+
+    def count(self, name):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + 1
+
+    @contextlib.contextmanager
+    def phase(self, name, **args):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.events.append({
+                'name': name, 'ph': 'X', 'pid': os.getpid(), 'tid': os.getpid(),
+                'ts': start * 1e6, 'dur': (time.perf_counter() - start) * 1e6, 'args': args})
+
+    def merge(self, counters, events):
+        for name, count in counters.items():
+            self.counters[name] = self.counters.get(name, 0) + count
+        self.events.extend(events)
+
+    def write_trace(self, path):
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms',
+                       'otherData': {'counters': self.counters}}, f)
+
+    def print_summary(self, file, slowest=10):
+        for name in ['parse files', 'format report']:
+            for event in self.events:
+                if event['name'] == name:
+                    print('{}: {:.1f} ms'.format(name, event['dur'] / 1000), file=file)
+        parses = sorted((event for event in self.events if event['name'] == 'parse'),
+                        key=lambda event: event['dur'], reverse=True)
+        if parses:
+            print('slowest files:', file=file)
+            for event in parses[:slowest]:
+                print('  {:8.1f} ms  {}'.format(event['dur'] / 1000, event['args']['file']), file=file)
+        print('counters:', file=file)
+        for name, count in sorted(self.counters.items()):
+            print('  {:40} {}'.format(name, count), file=file)
+
+COMPONENT_MAP = {}
+SYMBOLS = {'public' : set(), 'private' : set()}
+STATS = Stats()
+
+def _report(publish, symbol):
+    symbol = symbol.replace('~', '?')
+
+    if publish:
+        SYMBOLS['public'].add(symbol)
+    else:
+        SYMBOLS['private'].add(symbol)
+
+    if not DEBUG:
+        return
+
+    if publish:
+        print('  PUBLISH: {}'.format(symbol))
+    else:
+        print('NOPUBLISH: {}'.format(symbol))
+
+class _Stanza:
+    """A version node of a linker version script, e.g.
+    MIRAL_x.y { global: extern "C++" { ... }; local: *; } MIRAL_x.(y-1);"""
+    def __init__(self, name, start):
+        self.name = name
+        self.parent = None
+        self.start = start          # offsets of the stanza in the script text
+        self.end = None
+        self.global_start = None    # offset just after "global:"
+        self.symbols = set()        # the global patterns
+        self.hidden = set()         # patterns commented out in the stanza, which are never added
+        self.local = set()
+
+class SymbolsMap:
+    """The stanzas of a symbols.map version script, indexed so that checking
+    whether a symbol is already in the map doesn't rescan its text"""
+    TOKENS = re.compile(r'(?P<space>\s+)|(?P<comment>#[^\n]*)|(?P<string>"[^"]*")'
+                        r'|(?P<punctuation>[{};])|(?P<word>[^\s{};"#]+)')
+    COMMENTED_SYMBOL = re.compile(r'#\s+([^\s;]+);')
+
+    def __init__(self, text):
+        self.text = text
+        self.stanzas = []
+        self.version_of = {}        # symbol -> the name of the first stanza that has it
+        self.hidden = set()
+        self._parse(text)
+        for stanza in self.stanzas:
+            for symbol in stanza.symbols:
+                self.version_of.setdefault(symbol, stanza.name)
+            self.hidden |= stanza.hidden
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path, 'r') as f:
+            return cls(f.read())
+
+    def _tokens(self, text):
+        for match in self.TOKENS.finditer(text):
+            if match.lastgroup != 'space':
+                yield match.lastgroup, match.group(), match.start(), match.end()
+
+    def _parse(self, text):
+        stanza = None
+        section = None
+        depth = 0           # nesting of extern "..." { ... } blocks
+        closed = False      # seen the stanza's closing brace
+        for kind, token, start, end in self._tokens(text):
+            if kind == 'comment':
+                commented = self.COMMENTED_SYMBOL.match(token)
+                if stanza is not None and commented:
+                    stanza.hidden.add(commented.group(1))
+            elif stanza is None:
+                if kind != 'word':
+                    raise RuntimeError('unexpected "{}" between stanzas'.format(token))
+                stanza = _Stanza(token, start)
+                opened = False
+            elif not opened:
+                if token != '{':
+                    raise RuntimeError('expected "{{" after {}, not "{}"'.format(stanza.name, token))
+                opened = True
+            elif closed:
+                if token == ';':
+                    stanza.end = end
+                    self.stanzas.append(stanza)
+                    stanza, section, closed = None, None, False
+                elif kind == 'word' and stanza.parent is None:
+                    stanza.parent = token
+                else:
+                    raise RuntimeError('unexpected "{}" at the end of {}'.format(token, stanza.name))
+            elif token in ['global:', 'local:'] and depth == 0:
+                section = token[:-1]
+                if section == 'global' and stanza.global_start is None:
+                    stanza.global_start = end
+            elif token == '{':
+                depth += 1
+            elif token == '}':
+                if depth == 0:
+                    closed = True
+                else:
+                    depth -= 1
+            elif kind == 'word' and token != 'extern':
+                if section == 'local':
+                    stanza.local.add(token)
+                else:
+                    stanza.symbols.add(token)
+        if stanza is not None:
+            raise RuntimeError('unterminated stanza ' + stanza.name)
+
+def _is_library_symbol(symbol, namespace):
+    return namespace + '::' in symbol
+
+def _next_version(name):
+    """MIRAL_4.1 -> MIRAL_4.2"""
+    match = re.fullmatch(r'(.*\.)(\d+)', name)
+    if not match:
+        raise RuntimeError('cannot work out the version after ' + name)
+    return match.group(1) + str(int(match.group(2)) + 1)
+
+def _format_stanza(header, symbols, parent):
+    lines = [header]
+    if symbols:
+        lines.append('  extern "C++" {')
+        lines.extend('    {};'.format(symbol) for symbol in symbols)
+        lines.append('  };')
+    lines.append('')
+    if parent is None:
+        lines.append('local: *;\n};')
+    else:
+        lines.append('}} {};'.format(parent))
+    return '\n'.join(lines)
+
+def format_report(symbols_map, namespace, new_stanza=False):
+    """Returns symbols_map with the newly published symbols in namespace (e.g. miral) added.
+
+    Normally the last stanza (the version still in development) is rewritten
+    with every published symbol that isn't in an earlier stanza. With
+    new_stanza all of the existing stanzas are kept as they are and the
+    symbols that are in none of them go into a new minor version."""
+    text = symbols_map.text
+    last = symbols_map.stanzas[-1]
+
+    if new_stanza:
+        released = {stanza.name for stanza in symbols_map.stanzas}
+    else:
+        released = {stanza.name for stanza in symbols_map.stanzas[:-1]}
+
+    new_symbols = [symbol for symbol in sorted(SYMBOLS['public'])
+                   if symbols_map.version_of.get(symbol) not in released
+                   and symbol not in symbols_map.hidden
+                   and _is_library_symbol(symbol, namespace)]
+
+    if not new_stanza:
+        if last.global_start is None:
+            raise RuntimeError('no "global:" in ' + last.name)
+        return (text[:last.start]
+                + _format_stanza(text[last.start:last.global_start], new_symbols, last.parent)
+                + text[last.end:])
+
+    if not new_symbols:
+        return text
+
+    name = _next_version(last.name)
+    return (text[:last.end] + text[last.end:].rstrip('\n') + '\n\n'
+            + _format_stanza(name + ' {\nglobal:', new_symbols, last.name)
+            + text[last.end:])
+
+def _print_debug_info(definition, attributes):
+    if not DEBUG:
+        return
+    print()
+    _print_attribs(definition, attributes)
+    _print_location(definition)
+
+def _parse_member_def(context_name, member, is_class):
+    kind = member.attributes['kind']
+    STATS.count('members')
+
+    if kind in ['enum', 'typedef']:
+        STATS.count('members rejected: enum or typedef')
+        return
+
+    if member.is_template:
+        STATS.count('members rejected: template')
+        return
+
+    if kind in ['function'] and member.attributes['inline'] == 'yes':
+        STATS.count('members rejected: inline')
+        return
+
+    name = member.name
+
+    if name in ['__attribute__']:
+        STATS.count('members rejected: doxygen mis-parsing')
+        if DEBUG:
+            print('  ignoring doxygen mis-parsing:', member.argsstring)
+        return
+
+    if name.startswith('operator'):
+        name = 'operator'
+
+    if not context_name is None:
+        symbol = context_name + '::' + name
+    else:
+        symbol = name
+
+    is_function = kind == 'function'
+
+    if is_function:
+        _print_debug_info(member, ['kind', 'prot', 'static', 'virt'])
+    else:
+        _print_debug_info(member, ['kind', 'prot', 'static'])
+
+    if DEBUG:
+        print('  is_class:', is_class)
+
+    publish = _should_publish(is_class, is_function, member)
+
+    _report(publish, symbol + '*')
+
+    if is_function and member.attributes['virt'] == 'virtual':
+        _report(publish, 'non-virtual?thunk?to?' + symbol + '*')
+
+
+def _should_publish(is_class, is_function, member):
+    rule = _rejected_by(is_class, is_function, member)
+    STATS.count('members published' if rule is None else 'members rejected: ' + rule)
+    return rule is None
+
+def _rejected_by(is_class, is_function, member):
+    """Returns the first publishing rule that keeps member out of the map, or
+    None if it is published"""
+    (kind, static, prot) = _get_attribs(member)
+
+    if kind == 'define':
+        return 'define'
+
+    if is_class and not (is_function or static == 'yes'):
+        return 'non-static data member'
+
+    if prot == 'private':
+        if not is_function:
+            return 'private variable'
+        if member.attributes['virt'] != 'virtual':
+            return 'private non-virtual'
+
+    if member.argsstring is not None and member.argsstring.endswith('=0'):
+        return 'pure virtual'
+
+    return None
+
+
+def _is_skipped_compound_kind(kind):
+    return kind in ['page', 'file', 'example', 'union']
+
+def _parse_compound_def(compound):
+    kind = compound.attributes['kind']
+    STATS.count('compounds')
+
+    if _is_skipped_compound_kind(kind):
+        STATS.count('compounds skipped: ' + kind)
+        return
+
+    if kind in ['group']:
+        for member in compound.members:
+            _parse_member_def(None, member, False)
+        return
+
+    if kind in ['namespace']:
+        symbol = compound.name
+        for member in compound.members:
+            _parse_member_def(symbol, member, False)
+        return
+
+    filename = compound.location
+
+    if DEBUG:
+        print('  from file:', filename)
+
+    if '/examples/' in filename or '/test/' in filename or '[generated]' in filename or '[STL]' in filename:
+        STATS.count('compounds skipped: not library code')
+        return
+
+    if compound.is_template:
+        STATS.count('compounds rejected: template')
+        return
+
+    symbol = compound.name
+
+    publish = True
+
+    if publish:
+        if kind in ['class', 'struct']:
+            prot = compound.attributes['prot']
+            publish = prot != 'private'
+            STATS.count('compounds published' if publish else 'compounds rejected: private')
+            _print_debug_info(compound, ['kind', 'prot'])
+            _report(publish, 'vtable?for?' + symbol)
+            _report(publish, 'typeinfo?for?' + symbol)
+
+    if publish:
+        for member in compound.members:
+            _parse_member_def(symbol, member, kind in ['class', 'struct'])
+
+def _parse_compound_defs(xmldoc):
+    for node in xmldoc.getElementsByTagName('compounddef'):
+        _parse_compound_def(_CompoundDef.from_node(node))
+
+def _iterparse_compound_defs(filename):
+    """Streams the <compounddef>s from a Doxygen XML file without building a DOM.
+
+    Each <memberdef> is reduced to a _MemberDef as soon as it has been read
+    and its subtree is discarded, so only one compound's worth of members
+    is held at a time. Doxygen puts <location> after the members, so the
+    publishing decisions are still made once the whole compound is read."""
+    compound_kind = None
+    members = []
+    for event, element in ElementTree.iterparse(filename, events=('start', 'end')):
+        if event == 'start':
+            if element.tag == 'compounddef':
+                compound_kind = element.get('kind')
+                members = []
+            continue
+
+        if element.tag == 'memberdef':
+            if compound_kind is not None and not _is_skipped_compound_kind(compound_kind):
+                members.append(_MemberDef.from_element(element))
+            element.clear()
+        elif element.tag == 'compounddef':
+            view = _ElementView(element)
+            compound = _CompoundDef(
+                dict(element.attrib),
+                view.text('compoundname'),
+                view.file_location(),
+                view.has('templateparamlist'),
+                members)
+            compound_kind = None
+            element.clear()
+            _parse_compound_def(compound)
+
+# A lightweight scanner for the declarations in C++ headers, so that the map
+# can be regenerated without running Doxygen first. It only understands as
+# much C++ as the public headers use, and produces the same _CompoundDef and
+# _MemberDef descriptions as the Doxygen engines so that the same publishing
+# rules apply. --check-headers compares it with the Doxygen XML.
+
+_CPP_TOKENS = re.compile(r'''
+      (?P<space>\s+)
+    | (?P<comment>//[^\n]*|/\*.*?\*/)
+    | (?P<preprocessor>^[ \t]*\#(?:\\\n|[^\n])*)
+    | (?P<string>"(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')
+    | (?P<word>[A-Za-z_]\w*)
+    | (?P<number>\.?\d(?:[\w.']|[eEpP][-+])*)
+    | (?P<punctuation>::|->|\.\.\.|.)
+    ''', re.VERBOSE | re.DOTALL | re.MULTILINE)
+
+_ACCESS_SPECIFIERS = ['public', 'protected', 'private']
+_SKIPPED_DECLARATIONS = ['using', 'typedef', 'static_assert', 'friend']
+_CLOSING = {'(': ')', '[': ']', '{': '}', '<': '>'}
+
+def _cpp_tokens(text):
+    return [match.group() for match in _CPP_TOKENS.finditer(text)
+            if match.lastgroup not in ['space', 'comment', 'preprocessor']]
+
+def _skip_group(tokens, pos):
+    """Returns the position after the bracketed group that starts at pos"""
+    opening = tokens[pos]
+    closing = _CLOSING[opening]
+    depth = 0
+    while pos < len(tokens):
+        if tokens[pos] == opening:
+            depth += 1
+        elif tokens[pos] == closing:
+            depth -= 1
+            if depth == 0:
+                return pos + 1
+        pos += 1
+    raise RuntimeError('unbalanced "{}"'.format(opening))
+
+def _skip_statement(tokens, pos):
+    """Returns the position after the next ';' that isn't in brackets"""
+    while tokens[pos] != ';':
+        pos = _skip_group(tokens, pos) if tokens[pos] in '([{' else pos + 1
+    return pos + 1
+
+def _strip_attributes(tokens):
+    """Removes [[attributes]], __attribute__((...)) and alignas(...)"""
+    stripped = []
+    pos = 0
+    while pos < len(tokens):
+        if tokens[pos] == '[' and pos + 1 < len(tokens) and tokens[pos + 1] == '[':
+            pos = _skip_group(tokens, pos)
+        elif tokens[pos] in ['__attribute__', 'alignas'] and pos + 1 < len(tokens) and tokens[pos + 1] == '(':
+            pos = _skip_group(tokens, pos + 1)
+        else:
+            stripped.append(tokens[pos])
+            pos += 1
+    return stripped
+
+class _HeaderScanner:
+    """Turns the declarations in one header into _CompoundDefs"""
+    def __init__(self, filename):
+        self.filename = filename
+        self.compounds = []
+        with open(filename, 'r') as f:
+            self.tokens = _cpp_tokens(f.read())
+
+    def scan(self):
+        namespace = _CompoundDef({'kind': 'namespace'}, None, self.filename, False, [])
+        self._scan_scope(0, namespace, None)
+        return self.compounds
+
+    def _scan_scope(self, pos, compound, access):
+        """Scans the declarations from pos to the end of the scope, adding them
+        to compound. access is None in a namespace. Returns the position after
+        the closing brace."""
+        tokens = self.tokens
+        is_template = False
+        while pos < len(tokens):
+            token = tokens[pos]
+            following = tokens[pos + 1] if pos + 1 < len(tokens) else None
+            if token == '}':
+                return pos + 1
+            elif token == ';':
+                pos += 1
+            elif token in _ACCESS_SPECIFIERS and following == ':':
+                access = token
+                pos += 2
+            elif token == 'template':
+                pos = _skip_group(tokens, pos + 1) if following == '<' else pos + 1
+                is_template = True
+                continue
+            elif token == 'namespace' or (token == 'inline' and following == 'namespace'):
+                pos = self._scan_namespace(pos + (2 if token == 'inline' else 1), compound)
+            elif token == 'extern' and following is not None and following.startswith('"'):
+                if tokens[pos + 2] == '{':
+                    pos = self._scan_scope(pos + 3, compound, access)
+                else:
+                    pos += 2
+                    continue
+            elif token in _SKIPPED_DECLARATIONS:
+                pos = self._skip_declaration(pos)
+            elif token in ['class', 'struct', 'union', 'enum']:
+                pos = self._scan_type(pos, compound, access, is_template)
+            else:
+                pos = self._scan_member(pos, compound, access, is_template)
+            is_template = False
+        return pos
+
+    def _skip_declaration(self, pos):
+        tokens = self.tokens
+        while tokens[pos] != ';':
+            if tokens[pos] == '{':
+                pos = _skip_group(tokens, pos)
+                if tokens[pos] != ';':
+                    return pos      # a friend function defined in the class
+            else:
+                pos = _skip_group(tokens, pos) if tokens[pos] in '([' else pos + 1
+        return pos + 1
+
+    def _scan_namespace(self, pos, compound):
+        tokens = self.tokens
+        names = []
+        while tokens[pos] not in ['{', '=', ';']:
+            if tokens[pos] != '::':
+                names.append(tokens[pos])
+            pos += 1
+        if tokens[pos] != '{':
+            return _skip_statement(tokens, pos)
+        if compound.name is None:
+            name = '::'.join(names)
+        else:
+            name = '::'.join([compound.name] + names)
+        namespace = _CompoundDef({'kind': 'namespace'}, name, self.filename, False, [])
+        self.compounds.append(namespace)
+        return self._scan_scope(pos + 1, namespace, None)
+
+    def _scan_type(self, pos, compound, access, is_template):
+        """Scans a class, struct, union or enum definition (or skips a declaration using one)"""
+        tokens = self.tokens
+        kind = tokens[pos]
+        head = []
+        end = pos + 1
+        while tokens[end] not in ['{', ';', '(', '=']:
+            head.append(tokens[end])
+            end += 1
+        if tokens[end] == ';' and len(_strip_attributes(head)) == 1:
+            return end + 1      # a forward declaration
+        if tokens[end] != '{':
+            return self._scan_member(pos, compound, access, is_template)
+        if kind == 'enum':
+            return _skip_statement(tokens, end)
+
+        head = _strip_attributes(head)
+        if ':' in head:
+            head = head[:head.index(':')]
+        names = [token for token in head if token not in ['final', '::'] and re.match(r'\w', token)]
+        if not names:
+            return _skip_statement(tokens, end)  # an anonymous type
+        name = names[-1]
+        if compound.name is not None:
+            name = compound.name + '::' + name
+
+        definition = _CompoundDef(
+            {'kind': kind, 'prot': access or 'public'},
+            name, self.filename, is_template, [])
+        self.compounds.append(definition)
+        pos = self._scan_scope(end + 1, definition, 'private' if kind == 'class' else 'public')
+        return _skip_statement(tokens, pos)     # any declarators after the closing brace
+
+    def _scan_member(self, pos, compound, access, is_template):
+        """Scans a function or variable declaration (or definition)"""
+        tokens = self.tokens
+        declaration = []
+        has_body = False
+        parameters = None     # the position in declaration of the parameter list
+        operator = False
+        angles = 0
+        initialized = False
+        while pos < len(tokens):
+            token = tokens[pos]
+            if token == ';':
+                pos += 1
+                break
+            if token == '{':
+                if parameters is not None and not initialized:
+                    pos = _skip_group(tokens, pos)
+                    has_body = True
+                    break
+                group_end = _skip_group(tokens, pos)
+                declaration.extend(tokens[pos:group_end])
+                pos = group_end
+                continue
+            if token == ':' and parameters is not None and not initialized:
+                pos = self._skip_initializers(pos + 1)
+                has_body = True
+                break
+            if token == 'operator':
+                operator = True
+            elif token == '=' and angles == 0 and not operator:
+                initialized = True
+            elif token == '<' and not operator and declaration and re.match(r'\w', declaration[-1]):
+                angles += 1
+            elif token == '>' and angles > 0:
+                angles -= 1
+            elif token == '(' or token == '[':
+                if (token == '(' and parameters is None and angles == 0 and not initialized
+                        and declaration and declaration[-1] != '::'):
+                    if operator and tokens[pos + 1] == ')' and declaration[-1] == 'operator':
+                        declaration.extend(['(', ')'])      # operator()
+                        pos += 2
+                        continue
+                    parameters = len(declaration)
+                    operator = False
+                group_end = _skip_group(tokens, pos)
+                declaration.extend(tokens[pos:group_end])
+                pos = group_end
+                continue
+            declaration.append(token)
+            pos += 1
+
+        member = self._member_def(declaration, parameters, has_body, compound, access, is_template)
+        if member is not None:
+            compound.members.append(member)
+        return pos
+
+    def _skip_initializers(self, pos):
+        """Skips a constructor's member initializers and body"""
+        tokens = self.tokens
+        while tokens[pos] != '{':
+            pos = _skip_group(tokens, pos) if tokens[pos] in '(' else pos + 1
+            if tokens[pos] == '{' and tokens[pos - 1] not in [')', '}', ',', ':']:
+                pos = _skip_group(tokens, pos)    # a brace initializer
+        return _skip_group(tokens, pos)
+
+    def _member_def(self, declaration, parameters, has_body, compound, access, is_template):
+        if parameters is None:
+            return self._variable_def(declaration, compound, access, is_template)
+
+        prefix = _strip_attributes(declaration[:parameters])
+        if not prefix:
+            return None
+        if 'operator' in prefix:
+            name_start = prefix.index('operator')
+            name = ''.join(prefix[name_start:])
+        else:
+            name_start = len(prefix) - 1
+            name = prefix[name_start]
+            if name_start > 0 and prefix[name_start - 1] == '~':
+                name_start -= 1
+                name = '~' + name
+        if name_start > 0 and prefix[name_start - 1] == '::':
+            return None     # the definition of something declared elsewhere
+        specifiers = prefix[:name_start]
+
+        suffix_start = _skip_group(declaration, parameters)
+        suffix = _strip_attributes(declaration[suffix_start:])
+        pure = suffix[-2:] == ['=', '0']
+        if pure:
+            suffix = suffix[:-2]
+        argsstring = ' '.join(declaration[parameters:suffix_start] + suffix) + ('=0' if pure else '')
+
+        if pure:
+            virt = 'pure-virtual'
+        elif 'virtual' in specifiers or 'override' in suffix or 'final' in suffix:
+            virt = 'virtual'
+        else:
+            virt = 'non-virtual'
+
+        inline = 'inline' in specifiers or 'constexpr' in specifiers or (has_body and access is not None)
+        return _MemberDef(
+            {
+                'kind': 'function',
+                'prot': access or 'public',
+                'static': 'yes' if 'static' in specifiers else 'no',
+                'inline': 'yes' if inline else 'no',
+                'virt': virt,
+            },
+            name, argsstring, self.filename, is_template)
+
+    def _variable_def(self, declaration, compound, access, is_template):
+        declaration = _strip_attributes(declaration)
+        for end, token in enumerate(declaration):
+            if token in ['=', '{', '[', ':']:
+                declaration = declaration[:end]
+                break
+        if len(declaration) < 2 or not re.match(r'\w', declaration[-1]) or declaration[-2] == '::':
+            return None
+        return _MemberDef(
+            {
+                'kind': 'variable',
+                'prot': access or 'public',
+                'static': 'yes' if 'static' in declaration else 'no',
+            },
+            declaration[-1], '', self.filename, is_template)
+
+def _scan_header(filename):
+    for compound in _HeaderScanner(filename).scan():
+        _parse_compound_def(compound)
+
+XML_ENGINES = {
+    'iterparse': _iterparse_compound_defs,
+    'minidom': lambda filename: _parse_compound_defs(minidom.parse(filename)),
+}
+
+ENGINES = dict(XML_ENGINES, headers=_scan_header)
+
+def _parse_file(job):
+    """Parses one file, returning the public and private symbols found in it,
+    the error (if any) that stopped the parsing and the file's Stats"""
+    global STATS
+    filename, engine, stats = job
+    SYMBOLS['public'] = set()
+    SYMBOLS['private'] = set()
+    outer_stats = STATS
+    STATS = file_stats = Stats(stats)
+    error = None
+    try:
+        if DEBUG:
+            print('Processing:', filename)
+        with STATS.phase('parse', file=filename, engine=engine):
+            ENGINES[engine](filename)
+    except Exception as exception:
+        error = exception
+    finally:
+        STATS = outer_stats
+    return SYMBOLS['public'], SYMBOLS['private'], error, file_stats
+
+class _Cache:
+    """The symbols previously found in each file, keyed by the file's content hash.
+
+    The whole cache is discarded if this module (and so the publishing rules)
+    has changed since it was written."""
+    def __init__(self, path):
+        self.path = path
+        self.rules = _file_digest(__file__)
+        self.old_entries = {}
+        self.entries = {}
+        if path is None or not os.path.isfile(path):
+            return
+        try:
+            with open(path, 'r') as f:
+                cached = json.load(f)
+        except ValueError:
+            return
+        if cached.get('rules') == self.rules:
+            self.old_entries = cached['files']
+
+    def lookup(self, filename, digest):
+        entry = self.old_entries.get(filename)
+        if entry is None or entry['hash'] != digest:
+            return None
+        self.entries[filename] = entry
+        return set(entry['public']), set(entry['private']), None, None
+
+    def store(self, filename, digest, public, private):
+        self.entries[filename] = {'hash': digest, 'public': sorted(public), 'private': sorted(private)}
+
+    def save(self):
+        if self.path is None:
+            return
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump({'rules': self.rules, 'files': self.entries}, f)
+        os.replace(temp_path, self.path)
+
+def _file_digest(filename):
+    with open(filename, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def parse_files(filenames, engine, jobs=1, cache_path=None):
+    """Parses the files into SYMBOLS, using a pool of worker processes if jobs is
+    more than 1 (or 0, for one per CPU), and only parsing the files that have
+    changed since cache_path (if given) was written.
+
+    Each file is parsed into its own partial sets which are merged here, in
+    file order, so the result and the error messages don't depend on jobs."""
+    stats = STATS
+    with stats.phase('parse files', files=len(filenames), engine=engine, jobs=jobs):
+        _parse_files_into_symbols(filenames, engine, jobs, cache_path, stats)
+
+def _parse_files_into_symbols(filenames, engine, jobs, cache_path, stats):
+    cache = _Cache(cache_path)
+    digests = {}
+    results = {}
+    work = []
+    for filename in filenames:
+        try:
+            digests[filename] = _file_digest(filename)
+            results[filename] = cache.lookup(filename, digests[filename])
+        except OSError:
+            results[filename] = None
+        if results[filename] is None:
+            work.append((filename, engine, stats.enabled))
+        else:
+            stats.count('files from the cache')
+
+    if jobs == 1 or len(work) < 2:
+        parsed = [_parse_file(job) for job in work]
+    else:
+        processes = jobs or multiprocessing.cpu_count()
+        with multiprocessing.Pool(processes) as pool:
+            parsed = pool.map(_parse_file, work, max(1, len(work) // (4 * processes)))
+
+    for (filename, _, _), result in zip(work, parsed):
+        results[filename] = result
+        file_public, file_private, error, file_stats = result
+        stats.count('files parsed')
+        stats.merge(file_stats.counters, file_stats.events)
+        if error is None and filename in digests:
+            cache.store(filename, digests[filename], file_public, file_private)
+
+    public = set()
+    private = set()
+    for filename in filenames:
+        file_public, file_private, error, _ = results[filename]
+        public |= file_public
+        private |= file_private
+        if error is not None:
+            print('Error:', filename, error)
+
+    SYMBOLS['public'] = public
+    SYMBOLS['private'] = private
+    cache.save()
+
+def check_engines(filenames, jobs):
+    """Parses the files with every engine and reports any difference in the symbols found.
+    Returns True if all the engines agree."""
+    results = {}
+    for engine in XML_ENGINES:
+        parse_files(filenames, engine, jobs)
+        results[engine] = {key: set(symbols) for key, symbols in SYMBOLS.items()}
+
+    consistent = True
+    reference = results['minidom']
+    for engine, result in results.items():
+        for key in reference:
+            for symbol in sorted(reference[key] - result[key]):
+                print('{}: missing {} symbol: {}'.format(engine, key, symbol))
+                consistent = False
+            for symbol in sorted(result[key] - reference[key]):
+                print('{}: unexpected {} symbol: {}'.format(engine, key, symbol))
+                consistent = False
+    return consistent
+
+def check_headers(filenames, engine, jobs, header_dir, namespace):
+    """Compares the symbols in namespace published from the Doxygen XML files with
+    those from scanning the headers in header_dir. Returns True if they agree."""
+    parse_files(filenames, engine, jobs)
+    doxygen = {symbol for symbol in SYMBOLS['public'] if _is_library_symbol(symbol, namespace)}
+
+    headers = sorted(glob.glob(os.path.join(header_dir, '**', '*.h'), recursive=True))
+    parse_files(headers, 'headers', jobs)
+    scanned = {symbol for symbol in SYMBOLS['public'] if _is_library_symbol(symbol, namespace)}
+
+    for symbol in sorted(doxygen - scanned):
+        print('only in the Doxygen XML:', symbol)
+    for symbol in sorted(scanned - doxygen):
+        print('only in the headers:', symbol)
+    print('{} symbols found by both'.format(len(doxygen & scanned)))
+    return doxygen == scanned